@@ -0,0 +1,512 @@
+"""Replayable load benchmark for the gate's entry/exit path.
+
+    python benchmark.py generate bench --students 3000 --days 5 --seed 7
+    python benchmark.py replay bench [--rate 2000] [--json result.json]
+    python benchmark.py make-video bench lane1.avi --codes 40
+    python benchmark.py video bench lane1.avi [lane2.avi ...]
+    python benchmark.py faces --faces 20000 --queries 2000
+
+``generate`` writes a synthetic roster (roster.csv, in the format the
+student importer reads) and a day-by-day traffic file (traffic.csv) with
+a morning rush, lunch churn and an evening exit. The same seed always
+gives the same files, so runs before and after a change replay identical
+traffic. ``replay`` feeds that traffic through GateService into a fresh
+temporary database and reports latency percentiles, scans/sec and the
+database size; ``video`` does the same with QR codes decoded from
+recorded videos instead of a camera. ``faces`` compares the IVF face
+index with brute-force matching on synthetic descriptors: recall of the
+nearest face, agreement of the match decisions and query latency.
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import gate_db
+from gate_service import GateService, QR_AVAILABLE, SCAN_METHODS
+from face_index import IvfFaceIndex
+from face_match import DESCRIPTOR_SIZE, FaceMatcher
+from student_import import read_roster, validate
+
+DEPARTMENTS = ["Computer Science", "Information Technology", "Electronics",
+               "Electrical", "Mechanical", "Civil"]
+FIRST_NAMES = ["Aarav", "Aditi", "Arjun", "Diya", "Ishaan", "Kavya", "Meera", "Nikhil",
+               "Priya", "Rahul", "Riya", "Rohan", "Saanvi", "Sneha", "Varun", "Zoya"]
+LAST_NAMES = ["Sharma", "Patel", "Iyer", "Reddy", "Nair", "Gupta", "Khan", "Das",
+              "Mehta", "Joshi", "Rao", "Singh"]
+
+# Shape of a college day; times are minutes after midnight
+TRAFFIC_PROFILE = {
+    "attendance": 0.9,            # share of the roster that comes in on a weekday
+    "saturday_attendance": 0.25,
+    "arrival_mean": 8 * 60 + 45,  # morning rush
+    "arrival_sd": 20,
+    "late_share": 0.08,           # arrive any time until early afternoon instead
+    "lunch_share": 0.35,          # step out for lunch and come back
+    "lunch_mean": 12 * 60 + 30,
+    "lunch_sd": 20,
+    "lunch_minutes": (25, 75),
+    "leave_mean": 16 * 60 + 30,   # evening exit
+    "leave_sd": 40,
+    "early_leave_share": 0.06,
+    "unknown_share": 0.003,       # scans of IDs that are not in the roster
+}
+
+TRAFFIC_HEADER = ["scanned_at", "student_id", "lane", "direction"]
+
+# Rows the logs view reads when it loads: visible rows plus the margin on one side
+LOGS_VIEW_ROWS = 15 + 30
+
+
+def make_roster(count, rng):
+    students = []
+    for idx in range(count):
+        student_id = f"STU{idx + 1:06d}"
+        students.append({
+            "id": student_id,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "dept": str(rng.choice(DEPARTMENTS)),
+            "year": str(rng.integers(1, 5)),
+            "phone": f"9{rng.integers(0, 10 ** 9):09d}",
+            "email": f"{student_id.lower()}@college.edu",
+        })
+    return students
+
+
+def make_traffic(student_ids, days, start, rng, lanes=4, profile=TRAFFIC_PROFILE):
+    """[(scanned_at, student_id, lane, direction)] in time order, ``days`` days from ``start``"""
+    student_ids = np.array(student_ids)
+    lane_names = [f"Lane {idx + 1}" for idx in range(lanes)]
+    events = []
+    for day_idx in range(days):
+        day = start + timedelta(days=day_idx)
+        attendance = {5: profile["saturday_attendance"], 6: 0.0}.get(day.weekday(),
+                                                                      profile["attendance"])
+        day_start = len(events)
+        present = student_ids[rng.random(len(student_ids)) < attendance]
+        count = len(present)
+        if not count:
+            continue
+
+        arrive = rng.normal(profile["arrival_mean"], profile["arrival_sd"], count)
+        late = rng.random(count) < profile["late_share"]
+        arrive[late] = rng.uniform(9 * 60 + 30, 13 * 60 + 30, late.sum())
+        arrive = np.clip(arrive, 7 * 60, 14 * 60)
+
+        leave = rng.normal(profile["leave_mean"], profile["leave_sd"], count)
+        early = rng.random(count) < profile["early_leave_share"]
+        leave[early] = rng.uniform(13 * 60, 16 * 60, early.sum())
+        leave = np.clip(np.maximum(leave, arrive + 45), None, 21 * 60 + 30)
+
+        lunch_out = rng.normal(profile["lunch_mean"], profile["lunch_sd"], count)
+        lunch_back = lunch_out + rng.uniform(*profile["lunch_minutes"], count)
+        # Only students who are in well before lunch and stay well after it
+        lunch = ((rng.random(count) < profile["lunch_share"])
+                 & (lunch_out > arrive + 20) & (lunch_back < leave - 20))
+
+        seconds = rng.uniform(0, 60, (count, 4))
+        midnight = datetime.combine(day, datetime.min.time())
+        for idx, student_id in enumerate(present):
+            visits = [(arrive[idx], "in"), (leave[idx], "out")]
+            if lunch[idx]:
+                visits[1:1] = [(lunch_out[idx], "out"), (lunch_back[idx], "in")]
+            for (minute, direction), second in zip(visits, seconds[idx]):
+                scanned_at = midnight + timedelta(minutes=int(minute), seconds=int(second))
+                events.append((scanned_at, str(student_id),
+                               lane_names[rng.integers(lanes)], direction))
+
+        unknown = int((len(events) - day_start) * profile["unknown_share"])
+        for _ in range(unknown):
+            minute = rng.uniform(7 * 60, 18 * 60)
+            events.append((midnight + timedelta(minutes=minute), f"UNK{rng.integers(10 ** 6):06d}",
+                           lane_names[rng.integers(lanes)], ""))
+    # Timestamps are stored to the second; keep each student's own order on ties
+    events.sort(key=lambda event: event[0].replace(microsecond=0))
+    return events
+
+
+def write_traffic(path, events):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(TRAFFIC_HEADER)
+        for scanned_at, student_id, lane, direction in events:
+            writer.writerow([scanned_at.strftime("%Y-%m-%d %H:%M:%S"), student_id, lane, direction])
+
+
+def read_traffic(path):
+    with open(path, newline='') as csvfile:
+        return [(datetime.strptime(row["scanned_at"], "%Y-%m-%d %H:%M:%S"), row["student_id"],
+                 row["lane"] or None, row["direction"])
+                for row in csv.DictReader(csvfile)]
+
+
+def generate(data_dir, students, days, seed, lanes=4, start=None):
+    """Write roster.csv and traffic.csv for a benchmark run"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    roster = make_roster(students, rng)
+    with open(os.path.join(data_dir, "roster.csv"), 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=list(roster[0]) if roster else ["id", "name"])
+        writer.writeheader()
+        writer.writerows(roster)
+    # The traffic ends today, so a GUI opened on the replayed database shows the last day
+    start = start or date.today() - timedelta(days=days - 1)
+    events = make_traffic([student["id"] for student in roster], days, start, rng, lanes)
+    write_traffic(os.path.join(data_dir, "traffic.csv"), events)
+    return len(roster), len(events)
+
+
+def percentiles(samples_ms):
+    """p50/p99/max/mean of a list of milliseconds"""
+    if not samples_ms:
+        return {}
+    samples = np.asarray(samples_ms)
+    p50, p99 = np.percentile(samples, [50, 99])
+    return {"p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(samples.max()), 3), "mean_ms": round(float(samples.mean()), 3)}
+
+
+def time_ms(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return 1000 * (time.perf_counter() - start)
+
+
+def load_logs_view(conn, day):
+    """The reads load_today_logs does: change cursor, row count and the first window"""
+    conn.execute(gate_db.LOG_CHANGES_START_SQL, (day, day)).fetchone()
+    gate_db.TODAY_LOGS_QUERY.count(conn, (day,))
+    gate_db.TODAY_LOGS_QUERY.page_at(conn, (day,), 0, LOGS_VIEW_ROWS)
+
+
+def read_stats(conn, day):
+    """The read update_stats does"""
+    conn.execute(gate_db.DAILY_SUMMARY_SQL, (day,)).fetchone()
+
+
+class ReplayRecorder:
+    """Collects commit times of scans and the UI-read timings of one run"""
+
+    def __init__(self, service):
+        self.service = service
+        self.submitted = []
+        self.committed = {}
+        self.lookup_ms = []
+        self.logs_view_ms = []
+        self.stats_ms = []
+        service.add_scan_listener(self.on_commit)
+
+    def on_commit(self, jobs):
+        now = time.perf_counter()
+        for job in jobs:
+            self.committed[job] = now
+
+    def scan(self, student_id, scan_method, lane, scanned_at=None):
+        """What process_scan does for one scan: look the student up and submit"""
+        start = time.perf_counter()
+        self.service.lookup_student(student_id)
+        self.lookup_ms.append(1000 * (time.perf_counter() - start))
+        job = self.service.submit_scan(student_id, scan_method, lane, scanned_at=scanned_at)
+        self.submitted.append((job, start))
+        return job
+
+    def refresh_ui(self, day):
+        self.logs_view_ms.append(time_ms(load_logs_view, self.service.conn, day))
+        self.stats_ms.append(time_ms(read_stats, self.service.conn, day))
+
+    def report(self, started):
+        for job, _ in self.submitted:
+            job.done.wait()
+        finished = max(self.committed.values(), default=started)
+        scans = len(self.submitted)
+        errors = sum(1 for job, _ in self.submitted if job.error)
+        seconds = finished - started
+        return {
+            "scans": scans,
+            "errors": errors,
+            "seconds": round(seconds, 3),
+            "scans_per_sec": round(scans / seconds, 1) if seconds else 0.0,
+            "scan_to_commit": percentiles([1000 * (self.committed[job] - submitted)
+                                           for job, submitted in self.submitted]),
+            "student_lookup": percentiles(self.lookup_ms),
+            "load_today_logs": percentiles(self.logs_view_ms),
+            "update_stats": percentiles(self.stats_ms),
+        }
+
+
+def open_bench_service(data_dir, db_path, durability, commit_window):
+    """A GateService on a fresh database holding the benchmark roster"""
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    service = GateService(db_path, durability, commit_window).open()
+    students, problems = validate(read_roster(os.path.join(data_dir, "roster.csv")))
+    if problems:
+        raise ValueError(f"Benchmark roster has {len(problems)} invalid rows")
+    service.db_writer.call(gate_db.upsert_students, students)
+    return service
+
+
+def db_size(service, db_path):
+    """Bytes on disk once the WAL has been folded into the database file"""
+    service.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal")
+               if os.path.exists(path))
+
+
+def replay(data_dir, db_path, rate=0, ui_every=1000, durability="normal", commit_window=0.005):
+    """Replay traffic.csv through the entry/exit path and return the measurements.
+
+    ``rate`` paces submissions at that many scans/sec (0 = as fast as
+    possible). Every ``ui_every`` scans the logs view and statistics reads
+    are timed against the day being replayed.
+    """
+    events = read_traffic(os.path.join(data_dir, "traffic.csv"))
+    service = open_bench_service(data_dir, db_path, durability, commit_window)
+    try:
+        recorder = ReplayRecorder(service)
+        jobs = []
+        started = time.perf_counter()
+        for idx, (scanned_at, student_id, lane, direction) in enumerate(events):
+            if rate:
+                wait = started + idx / rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            jobs.append((recorder.scan(student_id, "QR", lane, scanned_at), direction))
+            if ui_every and idx % ui_every == ui_every - 1:
+                recorder.refresh_ui(scanned_at.strftime("%Y-%m-%d"))
+        result = recorder.report(started)
+        # The traffic says which way each student was going; the decisions must agree
+        result["wrong_direction"] = sum(
+            1 for job, direction in jobs
+            if direction and not job.error and job.result["action"] != ("entry" if direction == "in" else "exit"))
+        result["gate_logs_rows"] = service.conn.execute("SELECT COUNT(*) FROM gate_logs_all").fetchone()[0]
+        result["hot_log_rows"] = service.conn.execute("SELECT COUNT(*) FROM gate_logs").fetchone()[0]
+        result["db_bytes"] = db_size(service, db_path)
+        result["writer"] = service.db_writer.stats()
+    finally:
+        service.close()
+    return result
+
+
+def make_video(data_dir, path, codes=40, fps=15, seconds_per_code=1.5, size=(1280, 720), seed=0):
+    """Record a test video showing QR codes of IDs from the traffic, with gaps between them"""
+    import cv2
+    import qrcode
+
+    rng = np.random.default_rng(seed)
+    student_ids = []
+    for _, student_id, _, _ in read_traffic(os.path.join(data_dir, "traffic.csv")):
+        if student_id not in student_ids:
+            student_ids.append(student_id)
+        if len(student_ids) == codes:
+            break
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    blank = np.full((height, width, 3), 200, dtype=np.uint8)
+    try:
+        for student_id in student_ids:
+            qr = qrcode.QRCode(box_size=8, border=4)
+            qr.add_data(student_id)
+            qr.make(fit=True)
+            code = np.array(qr.make_image(fill_color="black", back_color="white").convert("RGB"))
+            side = int(rng.integers(160, 360))
+            code = cv2.resize(code, (side, side), interpolation=cv2.INTER_NEAREST)
+            x, y = int(rng.integers(0, width - side)), int(rng.integers(0, height - side))
+            frame = blank.copy()
+            frame[y:y + side, x:x + side] = code
+            for _ in range(int(fps * seconds_per_code)):
+                writer.write(frame)
+            for _ in range(int(fps * seconds_per_code / 2)):
+                writer.write(blank)
+    finally:
+        writer.release()
+    return student_ids
+
+
+def replay_video(data_dir, db_path, videos, durability="normal", commit_window=0.005,
+                 decode_mode="multiscale", scheduler_settings=None):
+    """Decode recorded videos (one lane each) in real time and record the scans"""
+    if not QR_AVAILABLE:
+        raise RuntimeError("QR libraries not installed!")
+    service = open_bench_service(data_dir, db_path, durability, commit_window)
+    try:
+        recorder = ReplayRecorder(service)
+        sources = {f"Lane {idx + 1}": os.path.abspath(video) for idx, video in enumerate(videos)}
+        failed = service.start_cameras(sources, decode_mode, scheduler_settings)
+        if failed:
+            raise RuntimeError(f"Could not open {', '.join(failed)}")
+        lanes = service.pipeline.lanes.values()
+        decode_latency_ms = []
+        started = time.perf_counter()
+        while True:
+            results = []
+            try:
+                while True:
+                    results.append(service.pipeline.results.get(timeout=0.05 if not results else 0))
+            except queue.Empty:
+                pass
+            for kind, student_id, captured_at, lane in results:
+                decode_latency_ms.append(1000 * (time.time() - captured_at))
+                if service.debounce.allow(student_id):
+                    recorder.scan(student_id, SCAN_METHODS[kind], lane)
+            if not results and not any(lane.capture.is_alive() or lane.in_flight for lane in lanes):
+                break
+        result = recorder.report(started)
+        result["capture_to_decoded"] = percentiles(decode_latency_ms)
+        result["lanes"] = service.pipeline.stats()
+        result["db_bytes"] = db_size(service, db_path)
+    finally:
+        service.close()
+    return result
+
+
+def make_descriptors(count, rng, groups=256):
+    """Synthetic face descriptors spread like real ones: people ~0.9 apart, in loose groups"""
+    centers = rng.normal(0, 0.06, (groups, DESCRIPTOR_SIZE))
+    people = centers[rng.integers(groups, size=count)] + rng.normal(0, 0.056, (count, DESCRIPTOR_SIZE))
+    return people.astype(np.float32)
+
+
+def face_benchmark(faces=20000, queries=2000, nprobes=(1, 2, 4, 8, 16, 32), seed=1):
+    """Recall and latency of the IVF index against brute force on the same descriptors"""
+    rng = np.random.default_rng(seed)
+    enrolled = make_descriptors(faces, rng)
+    student_ids = [f"F{idx:06d}" for idx in range(faces)]
+    # Most queries are enrolled people seen again (~0.35 away), the rest strangers
+    known = rng.integers(faces, size=queries)
+    query_set = enrolled[known] + rng.normal(0, 0.031, (queries, DESCRIPTOR_SIZE)).astype(np.float32)
+    strangers = rng.random(queries) < 0.2
+    query_set[strangers] = make_descriptors(int(strangers.sum()), rng)
+
+    brute = FaceMatcher()
+    for student_id, vector in zip(student_ids, enrolled):
+        brute.add(student_id, vector)
+    start = time.perf_counter()
+    index = IvfFaceIndex()
+    index.build(student_ids, enrolled)
+    build_seconds = time.perf_counter() - start
+
+    expected, brute_ms = [], []
+    for query in query_set:
+        start = time.perf_counter()
+        expected.append((brute.nearest(query), brute.match(query)))
+        brute_ms.append(1000 * (time.perf_counter() - start) / 2)
+    result = {
+        "faces": faces,
+        "queries": queries,
+        "ivf_lists": len(index.lists),
+        "ivf_build_s": round(build_seconds, 2),
+        "brute_force": percentiles(brute_ms),
+    }
+    for nprobe in nprobes:
+        if nprobe > len(index.lists):
+            break
+        found, latency_ms = [], []
+        for query in query_set:
+            start = time.perf_counter()
+            found.append(index.match(query, nprobe))
+            latency_ms.append(1000 * (time.perf_counter() - start))
+        nearest_hits = sum(1 for (nearest, _), match in zip(expected, found)
+                           if match and match[0] == nearest[0])
+        should_match = sum(1 for _, match in expected if match)
+        result[f"nprobe_{nprobe}"] = {
+            "recall": round(nearest_hits / max(1, should_match), 4),
+            "same_decision": round(sum(1 for (_, want), got in zip(expected, found)
+                                       if (want and want[0]) == (got and got[0])) / queries, 4),
+            **percentiles(latency_ms),
+        }
+    return result
+
+
+def print_report(title, result):
+    print(f"\n{title}")
+    for name, value in result.items():
+        if isinstance(value, dict) and value and all(not isinstance(v, dict) for v in value.values()):
+            value = "  ".join(f"{key}={val}" for key, val in value.items())
+        print(f"  {name:18} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gate entry/exit benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="write a synthetic roster and traffic")
+    gen.add_argument("data_dir")
+    gen.add_argument("--students", type=int, default=3000)
+    gen.add_argument("--days", type=int, default=5)
+    gen.add_argument("--lanes", type=int, default=4)
+    gen.add_argument("--seed", type=int, default=1)
+
+    for name, help_text in (("replay", "replay the traffic through the entry/exit path"),
+                            ("video", "decode recorded videos and record their scans")):
+        run = commands.add_parser(name, help=help_text)
+        run.add_argument("data_dir")
+        if name == "video":
+            run.add_argument("videos", nargs="+", help="one recorded video per lane")
+        else:
+            run.add_argument("--rate", type=float, default=0,
+                             help="scans/sec to submit at (default: as fast as possible)")
+            run.add_argument("--ui-every", type=int, default=1000,
+                             help="time the logs view and stats reads every N scans")
+        run.add_argument("--durability", default="normal", choices=sorted(gate_db.DURABILITY_LEVELS))
+        run.add_argument("--commit-window", type=float, default=0.005)
+        run.add_argument("--db", help="database to (re)create; default: a temporary one")
+        run.add_argument("--json", help="also write the results to this file")
+
+    faces = commands.add_parser("faces", help="IVF face index recall and latency against brute force")
+    faces.add_argument("--faces", type=int, default=20000)
+    faces.add_argument("--queries", type=int, default=2000)
+    faces.add_argument("--seed", type=int, default=1)
+    faces.add_argument("--json", help="also write the results to this file")
+
+    video = commands.add_parser("make-video", help="record a test video of QR codes from the traffic")
+    video.add_argument("data_dir")
+    video.add_argument("path")
+    video.add_argument("--codes", type=int, default=40)
+    video.add_argument("--fps", type=int, default=15)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        students, events = generate(args.data_dir, args.students, args.days, args.seed, args.lanes)
+        print(f"Wrote {students} students and {events} scans to {args.data_dir}")
+        return
+    if args.command == "faces":
+        result = face_benchmark(args.faces, args.queries, seed=args.seed)
+        print_report(f"Face index vs brute force ({args.faces} faces)", result)
+        if args.json:
+            with open(args.json, 'w') as jsonfile:
+                json.dump(result, jsonfile, indent=2)
+        return
+    if args.command == "make-video":
+        student_ids = make_video(args.data_dir, args.path, args.codes, args.fps)
+        print(f"Wrote {len(student_ids)} QR codes to {args.path}")
+        return
+
+    temp_dir = None if args.db else tempfile.mkdtemp(prefix="gate-bench-")
+    db_path = args.db or os.path.join(temp_dir, "college_gate.db")
+    try:
+        if args.command == "replay":
+            result = replay(args.data_dir, db_path, args.rate, args.ui_every,
+                            args.durability, args.commit_window)
+        else:
+            result = replay_video(args.data_dir, db_path, args.videos,
+                                  args.durability, args.commit_window)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    print_report(f"{args.command} of {args.data_dir} ({args.durability} durability)", result)
+    if args.json:
+        with open(args.json, 'w') as jsonfile:
+            json.dump(result, jsonfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import csv
+import importlib.util
+import os
+import threading
+
+import numpy as np
+
+import gate_db
+
+# Optional columnar output. pyarrow takes a noticeable time to import, so
+# it is only loaded when a Parquet/Arrow file is actually written.
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+if not ARROW_AVAILABLE:
+    print("Parquet/Arrow export disabled. Install: pip install pyarrow")
+
+# Rows fetched and written per step; memory use is bounded by one chunk
+EXPORT_CHUNK_ROWS = 5000
+
+# Output formats by file extension
+EXPORT_FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+}
+
+# Report grouping name -> column of gate_db.REPORT_ROWS_SQL
+REPORT_GROUPINGS = {
+    "date": "log_date",
+    "department": "department",
+    "year": "year",
+    "lane": "lane",
+    "hour": "entry_hour",
+}
+
+# Columns of REPORT_ROWS_SQL that are not strings; NULL durations become NaN
+REPORT_DTYPES = {
+    "entry_hour": np.int64,
+    "duration_min": np.float64,
+}
+
+REPORT_METRICS = ["entries", "exits", "unique_students", "avg_duration_min"]
+
+
+class QueryExport(threading.Thread):
+    """Runs a query on a worker thread and writes the result to a file.
+
+    The thread opens its own read connection and reads the count and the
+    rows in one transaction, so both come from the same snapshot while the
+    writer thread keeps committing scans. Subclasses implement
+    ``write(cursor, path)`` and add to ``rows_done`` as they go.
+
+    The file is written as ``<filename>.part`` and only renamed into place
+    once complete. ``cancel()`` stops after the current chunk and removes
+    the partial file. ``rows_done`` and ``rows_total`` can be read from the
+    UI thread to show progress.
+    """
+
+    def __init__(self, filename, sql, params=(), db_path=gate_db.DB_PATH,
+                 chunk_rows=EXPORT_CHUNK_ROWS):
+        super().__init__(name="export", daemon=True)
+        self.filename = filename
+        self.sql = sql
+        self.params = tuple(params)
+        self.db_path = db_path
+        self.chunk_rows = chunk_rows
+        self.rows_done = 0
+        self.rows_total = None
+        self.error = None
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self):
+        """Fraction done between 0 and 1, or None while counting"""
+        if self.rows_total is None:
+            return None
+        if not self.rows_total:
+            return 1.0
+        return min(1.0, self.rows_done / self.rows_total)
+
+    def chunks(self, cursor):
+        """fetchmany() chunks until the rows run out or the export is cancelled"""
+        while not self.cancelled.is_set():
+            rows = cursor.fetchmany(self.chunk_rows)
+            if not rows:
+                break
+            yield rows
+            self.rows_done += len(rows)
+
+    def run(self):
+        part = self.filename + ".part"
+        conn = None
+        try:
+            conn = gate_db.connect(self.db_path)
+            conn.execute("BEGIN")
+            self.rows_total = conn.execute(f"SELECT COUNT(*) FROM ({self.sql})", self.params).fetchone()[0]
+            self.write(conn.execute(self.sql, self.params), part)
+            if self.cancelled.is_set():
+                os.remove(part)
+            else:
+                os.replace(part, self.filename)
+        except Exception as e:
+            self.error = e
+            if os.path.exists(part):
+                os.remove(part)
+        finally:
+            if conn:
+                conn.close()
+
+    def write(self, cursor, path):
+        raise NotImplementedError
+
+
+class CsvExport(QueryExport):
+    """Streams the rows of a query into a CSV file, one chunk at a time"""
+
+    def __init__(self, filename, sql, params=(), header=None, **kwargs):
+        super().__init__(filename, sql, params, **kwargs)
+        self.header = header
+
+    def write(self, cursor, path):
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            if self.header:
+                writer.writerow(self.header)
+            for rows in self.chunks(cursor):
+                writer.writerows(rows)
+
+
+class ReportExport(QueryExport):
+    """Gate traffic between two dates as raw log rows or grouped totals.
+
+    Rows are read in chunks into NumPy column arrays. Without ``group_by``
+    each chunk is written as soon as it is read, which is what analytics
+    jobs load; with it (names from REPORT_GROUPINGS) each chunk is folded
+    into GroupTotals. Either way memory stays flat however long the date
+    range. The output format follows the file extension: .csv, .parquet
+    or .arrow (Arrow IPC), the last two needing pyarrow.
+    """
+
+    def __init__(self, filename, since, until, group_by=None, **kwargs):
+        super().__init__(filename, gate_db.REPORT_ROWS_SQL, (since, until), **kwargs)
+        self.group_by = list(group_by or [])
+        unknown = [name for name in self.group_by if name not in REPORT_GROUPINGS]
+        if unknown:
+            raise ValueError(f"Unknown report grouping: {', '.join(unknown)}")
+        self.format = EXPORT_FORMATS.get(os.path.splitext(filename)[1].lower())
+        if self.format is None:
+            raise ValueError(f"Unsupported export format: {filename}")
+        if self.format != "csv" and not ARROW_AVAILABLE:
+            raise ValueError("Parquet/Arrow export needs pyarrow installed")
+
+    def write(self, cursor, path):
+        names = [column[0] for column in cursor.description]
+        if not self.group_by:
+            dtypes = {name: np.dtype(REPORT_DTYPES.get(name, object)) for name in names}
+            with TableWriter(path, dtypes, self.format) as writer:
+                for rows in self.chunks(cursor):
+                    writer.write(chunk_columns(rows, names))
+            return
+        totals = GroupTotals([REPORT_GROUPINGS[name] for name in self.group_by])
+        for rows in self.chunks(cursor):
+            totals.add(chunk_columns(rows, names))
+        if not self.cancelled.is_set():
+            write_table(totals.result(), path, self.format)
+
+
+def chunk_columns(rows, names):
+    """A chunk of rows -> {name: NumPy array}; numeric columns get numeric dtypes"""
+    columns = zip(*rows) if rows else [()] * len(names)
+    return {name: np.array(values, dtype=REPORT_DTYPES.get(name, object))
+            for name, values in zip(names, columns)}
+
+
+class GroupTotals:
+    """REPORT_METRICS per combination of ``keys``, merged one chunk at a time.
+
+    Group keys and student IDs get integer codes from dicts, so Python only
+    touches each distinct value of a chunk, not each row. Counts and
+    duration sums are per-group arrays. Unique students need the distinct
+    (group, student) pairs; they are kept as int64 codes, deduplicated
+    whenever the pending ones outgrow the merged set.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.groups = {}
+        self.students = {}
+        self.entries = np.zeros(0, dtype=np.int64)
+        self.exits = np.zeros(0, dtype=np.int64)
+        self.minutes = np.zeros(0)
+        self.pairs = np.zeros(0, dtype=np.int64)
+        self.pending = []
+        self.pending_size = 0
+
+    def codes(self, values, table):
+        """Code of every value, adding new ones to ``table``"""
+        uniques, inverse = np.unique(values, return_inverse=True)
+        mapped = np.array([table.setdefault(value, len(table)) for value in uniques.tolist()], dtype=np.int64)
+        return mapped[inverse.reshape(-1)]
+
+    def add(self, columns):
+        count = len(columns["student_id"])
+        if not count:
+            return
+        if self.keys:
+            key_codes = np.stack([self.codes(columns[key], {}) for key in self.keys], axis=1)
+            _, first, inverse = np.unique(key_codes, axis=0, return_index=True, return_inverse=True)
+            mapped = np.array([self.groups.setdefault(tuple(columns[key][row] for key in self.keys), len(self.groups))
+                               for row in first.tolist()], dtype=np.int64)
+            group_of_row = mapped[inverse.reshape(-1)]
+        else:
+            group_of_row = np.full(count, self.groups.setdefault((), 0), dtype=np.int64)
+        student_of_row = self.codes(columns["student_id"], self.students)
+
+        groups = len(self.groups)
+        self.entries = self.grown(self.entries, groups) + np.bincount(group_of_row, minlength=groups)
+        has_exit = ~np.isnan(columns["duration_min"])
+        self.exits = self.grown(self.exits, groups) + np.bincount(group_of_row[has_exit], minlength=groups)
+        self.minutes = self.grown(self.minutes, groups) + np.bincount(
+            group_of_row, weights=np.where(has_exit, columns["duration_min"], 0.0), minlength=groups)
+
+        self.pending.append(np.unique((group_of_row << 32) | student_of_row))
+        self.pending_size += len(self.pending[-1])
+        if self.pending_size > len(self.pairs):
+            self.merge_pairs()
+
+    @staticmethod
+    def grown(array, size):
+        if len(array) == size:
+            return array
+        return np.concatenate([array, np.zeros(size - len(array), dtype=array.dtype)])
+
+    def merge_pairs(self):
+        self.pairs = np.unique(np.concatenate([self.pairs] + self.pending))
+        self.pending = []
+        self.pending_size = 0
+
+    def result(self):
+        """{name: array} of the key columns and REPORT_METRICS, sorted by the keys"""
+        self.merge_pairs()
+        groups = list(self.groups)
+        order = sorted(range(len(groups)), key=lambda group: groups[group])
+        unique_students = np.bincount(self.pairs >> 32, minlength=len(groups))
+        avg_minutes = np.full(len(groups), np.nan)
+        np.divide(self.minutes, self.exits, out=avg_minutes, where=self.exits > 0)
+
+        result = {}
+        for idx, key in enumerate(self.keys):
+            result[key] = np.array([groups[group][idx] for group in order], dtype=REPORT_DTYPES.get(key, object))
+        result["entries"] = self.entries[order]
+        result["exits"] = self.exits[order]
+        result["unique_students"] = unique_students[order]
+        result["avg_duration_min"] = np.round(avg_minutes[order], 1)
+        return result
+
+
+class TableWriter:
+    """Writes {name: array} chunks as CSV, Parquet or Arrow IPC, one chunk at a time.
+
+    ``dtypes`` maps each column to its NumPy dtype; integer and float
+    columns keep their type in Parquet/Arrow, everything else is a string.
+    """
+
+    def __init__(self, path, dtypes, format="csv"):
+        if format not in ("csv", "parquet", "arrow"):
+            raise ValueError(f"Unsupported export format: {format}")
+        self.path = path
+        self.dtypes = dtypes
+        self.names = list(dtypes)
+        self.format = format
+        self.file = None
+        self.writer = None
+
+    def __enter__(self):
+        if self.format == "csv":
+            self.file = open(self.path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.names)
+            return self
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet as pq
+        types = {"i": pa.int64(), "f": pa.float64()}
+        self.schema = pa.schema([(name, types.get(dtype.kind, pa.string())) for name, dtype in self.dtypes.items()])
+        if self.format == "parquet":
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            self.file = pa.OSFile(self.path, "wb")
+            self.writer = pa.ipc.new_file(self.file, self.schema)
+        return self
+
+    def write(self, table):
+        if self.format == "csv":
+            for row in zip(*(table[name].tolist() for name in self.names)):
+                self.writer.writerow(["" if isinstance(value, float) and value != value else value
+                                      for value in row])
+            return
+        import pyarrow as pa
+        batch = pa.record_batch([pa.array(table[field.name], type=field.type, from_pandas=True)
+                                 for field in self.schema], schema=self.schema)
+        self.writer.write_batch(batch)
+
+    def __exit__(self, *exc):
+        if self.format != "csv":
+            self.writer.close()
+        if self.file:
+            self.file.close()
+        return False
+
+
+def write_table(table, path, format="csv"):
+    """Write {name: array} columns as CSV, Parquet or Arrow IPC"""
+    with TableWriter(path, {name: column.dtype for name, column in table.items()}, format) as writer:
+        writer.write(table)
@@ -0,0 +1,241 @@
+import os
+import threading
+
+import numpy as np
+
+import gate_db
+from face_match import DESCRIPTOR_SIZE, FACE_MATCH_THRESHOLD, FaceMatcher, descriptor_array
+
+# Below this many enrolled faces brute force is exact and already fast enough
+IVF_MIN_FACES = 2000
+# Inverted lists searched per query; more lists is better recall, slower search
+IVF_NPROBE = 8
+# Retrain the coarse quantizer once the index has grown this much since training
+IVF_RETRAIN_GROWTH = 4
+# k-means trains on at most this many points per list
+IVF_TRAIN_POINTS_PER_LIST = 64
+KMEANS_ITERATIONS = 15
+
+
+def face_index_path(db_path):
+    """Where the face index of a database is kept, next to the database file"""
+    return os.path.splitext(db_path)[0] + ".faces.npz"
+
+
+def nearest_centroids(data, centroids, chunk_rows=4096):
+    """Index of the nearest centroid for every row of ``data``"""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_rows):
+        chunk = data[start:start + chunk_rows]
+        assignment[start:start + len(chunk)] = np.argmin(centroid_norms - 2 * (chunk @ centroids.T), axis=1)
+    return assignment
+
+
+def kmeans(data, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Lloyd's k-means; empty clusters are reseeded from random points"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(data, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        order = np.argsort(assignment, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[filled])[:-1]))
+        sums[filled] = np.add.reduceat(data[order], starts, axis=0)
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class IvfFaceIndex:
+    """Inverted-file index over face descriptors, for campus-scale enrolment.
+
+    A k-means coarse quantizer splits the descriptors into ``nlist`` lists
+    (about the square root of the enrolment). A query ranks the centroids
+    and searches only the ``nprobe`` nearest lists exactly, each one a
+    face_match.FaceMatcher, so a search reads a few hundred rows instead
+    of every enrolled face. ``match()`` applies the same threshold as the
+    brute-force matcher and has the same interface.
+
+    ``add()`` and ``remove()`` update one list in place; the centroids
+    stay until the index has grown ``IVF_RETRAIN_GROWTH`` times, when the
+    next ``load()`` retrains them. The centroids and list assignments are
+    saved to ``path`` by ``save()``; ``load()`` reconciles the file with
+    the students table, so faces enrolled or removed while the file was
+    stale are picked up without retraining.
+    """
+
+    def __init__(self, path=None, nprobe=IVF_NPROBE, threshold=FACE_MATCH_THRESHOLD):
+        self.path = path
+        self.nprobe = nprobe
+        self.threshold = threshold
+        self.centroids = np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+        self.centroid_norms = np.empty(0, dtype=np.float32)
+        self.lists = []
+        self.list_of = {}
+        self.trained_size = 0
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.matches = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.list_of)
+
+    def load(self, conn):
+        """Fill the index from the students table, reusing the saved quantizer if it still fits"""
+        student_ids, vectors = [], []
+        for student_id, blob in conn.execute(gate_db.FACE_DESCRIPTORS_SQL):
+            try:
+                vectors.append(descriptor_array(blob))
+            except ValueError as e:
+                print(f"Skipping face descriptor of {student_id}: {str(e)}")
+                continue
+            student_ids.append(student_id)
+        matrix = np.array(vectors, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE)
+
+        saved = self.read_saved()
+        if saved is None or len(matrix) > IVF_RETRAIN_GROWTH * max(1, saved["trained_size"]):
+            self.build(student_ids, matrix)
+            return self
+
+        # Keep the saved list of every face whose descriptor is unchanged
+        centroids = saved["centroids"]
+        assignment = nearest_centroids(matrix, centroids) if len(matrix) else np.empty(0, dtype=np.int64)
+        saved_rows = {student_id: row for row, student_id in enumerate(saved["student_ids"].tolist())}
+        reused = 0
+        for row, student_id in enumerate(student_ids):
+            saved_row = saved_rows.get(student_id)
+            if saved_row is not None and np.array_equal(saved["vectors"][saved_row], matrix[row]):
+                assignment[row] = saved["lists"][saved_row]
+                reused += 1
+        self.fill(centroids, student_ids, matrix, assignment, int(saved["trained_size"]))
+        self.dirty = reused != len(student_ids) or len(saved["student_ids"]) != len(student_ids)
+        return self
+
+    def build(self, student_ids, matrix, seed=0):
+        """Train the quantizer on ``matrix`` and index every row"""
+        count = len(student_ids)
+        nlist = max(1, int(np.sqrt(count)))
+        if count:
+            rng = np.random.default_rng(seed)
+            sample = matrix
+            if count > nlist * IVF_TRAIN_POINTS_PER_LIST:
+                sample = matrix[rng.choice(count, nlist * IVF_TRAIN_POINTS_PER_LIST, replace=False)]
+            centroids = kmeans(sample, nlist, seed=seed)
+            assignment = nearest_centroids(matrix, centroids)
+        else:
+            centroids = np.zeros((1, DESCRIPTOR_SIZE), dtype=np.float32)
+            assignment = np.empty(0, dtype=np.int64)
+        self.fill(centroids, student_ids, matrix, assignment, count)
+        self.dirty = True
+
+    def fill(self, centroids, student_ids, matrix, assignment, trained_size):
+        lists = [FaceMatcher(self.threshold) for _ in range(len(centroids))]
+        list_of = {}
+        for student_id, vector, list_idx in zip(student_ids, matrix, assignment.tolist()):
+            lists[list_idx].add(student_id, vector)
+            list_of[student_id] = list_idx
+        with self.lock:
+            self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+            self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+            self.lists = lists
+            self.list_of = list_of
+            self.trained_size = trained_size
+
+    def add(self, student_id, descriptor):
+        """Enrol or replace the descriptor of ``student_id``"""
+        vector = descriptor_array(descriptor)
+        student_id = str(student_id)
+        with self.lock:
+            list_idx = int(np.argmin(self.centroid_norms - 2 * (self.centroids @ vector)))
+            previous = self.list_of.get(student_id)
+            if previous is not None and previous != list_idx:
+                self.lists[previous].remove(student_id)
+            self.lists[list_idx].add(student_id, vector)
+            self.list_of[student_id] = list_idx
+            self.dirty = True
+
+    def remove(self, student_id):
+        student_id = str(student_id)
+        with self.lock:
+            list_idx = self.list_of.pop(student_id, None)
+            if list_idx is not None:
+                self.lists[list_idx].remove(student_id)
+                self.dirty = True
+
+    def nearest(self, query, nprobe=None):
+        """(student_id, squared distance) of the nearest face in the probed lists, or None"""
+        with self.lock:
+            scores = self.centroid_norms - 2 * (self.centroids @ query)
+            nprobe = min(nprobe or self.nprobe, len(scores))
+            probe = np.argpartition(scores, nprobe - 1)[:nprobe] if nprobe < len(scores) else range(len(scores))
+            best = None
+            for list_idx in probe:
+                found = self.lists[list_idx].nearest(query)
+                if found and (best is None or found[1] < best[1]):
+                    best = found
+        return best
+
+    def match(self, descriptor, nprobe=None):
+        """(student_id, distance) of the nearest enrolled face under the threshold, or None"""
+        nearest = self.nearest(descriptor_array(descriptor), nprobe)
+        distance = float(np.sqrt(max(nearest[1], 0.0))) if nearest else None
+        if distance is None or distance >= self.threshold:
+            self.misses += 1
+            return None
+        self.matches += 1
+        return nearest[0], distance
+
+    def read_saved(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as saved:
+                saved = {name: saved[name] for name in saved.files}
+            if saved["centroids"].shape[1:] != (DESCRIPTOR_SIZE,):
+                raise ValueError("descriptor size differs")
+            return saved
+        except Exception as e:
+            print(f"Rebuilding face index, could not read {self.path}: {str(e)}")
+            return None
+
+    def save(self):
+        """Write the quantizer and list assignments next to the database if anything changed"""
+        if not self.path or not self.dirty:
+            return
+        with self.lock:
+            student_ids, vectors, lists = [], [], []
+            for list_idx, face_list in enumerate(self.lists):
+                count = len(face_list)
+                student_ids.extend(face_list.student_ids)
+                vectors.append(face_list.matrix[:count])
+                lists.extend([list_idx] * count)
+            centroids = self.centroids.copy()
+            trained_size = self.trained_size
+            self.dirty = False
+        # Write then rename, so a crash never leaves half an index behind
+        part = f"{self.path}.part"
+        with open(part, "wb") as npzfile:
+            np.savez(npzfile, centroids=centroids, student_ids=np.array(student_ids, dtype=str),
+                     vectors=np.concatenate(vectors) if vectors else np.empty((0, DESCRIPTOR_SIZE), np.float32),
+                     lists=np.array(lists, dtype=np.int64), trained_size=np.int64(trained_size))
+        os.replace(part, self.path)
+
+    def stats(self):
+        sizes = [len(face_list) for face_list in self.lists]
+        return {"enrolled": len(self), "lists": len(sizes), "nprobe": self.nprobe,
+                "largest_list": max(sizes, default=0), "trained_size": self.trained_size,
+                "matches": self.matches, "misses": self.misses}
+
+
+def open_face_index(conn, path):
+    """The face matcher for a database: brute force while small, IVF at campus scale"""
+    enrolled = conn.execute(f"SELECT COUNT(*) FROM ({gate_db.FACE_DESCRIPTORS_SQL})").fetchone()[0]
+    if enrolled < IVF_MIN_FACES and not os.path.exists(path):
+        return FaceMatcher().load(conn)
+    return IvfFaceIndex(path).load(conn)
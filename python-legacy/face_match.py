@@ -0,0 +1,168 @@
+import importlib.util
+import threading
+
+import numpy as np
+
+import gate_db
+
+# face_recognition (dlib) is slow to import and only needed to compute
+# descriptors from images; matching stored descriptors needs NumPy alone
+FACE_RECOGNITION_AVAILABLE = importlib.util.find_spec("face_recognition") is not None
+
+DESCRIPTOR_SIZE = 128
+# Euclidean distance under which two descriptors are the same person,
+# the same threshold as compareFaces in the web app (web-app/src/lib/faceApi.ts)
+FACE_MATCH_THRESHOLD = 0.6
+
+
+def descriptor_array(descriptor):
+    """A descriptor (list, array or stored BLOB) as a float32 vector"""
+    if isinstance(descriptor, (bytes, bytearray, memoryview)):
+        vector = np.frombuffer(descriptor, dtype=np.float32)
+    else:
+        vector = np.asarray(descriptor, dtype=np.float32).reshape(-1)
+    if vector.shape != (DESCRIPTOR_SIZE,):
+        raise ValueError(f"Face descriptor must have {DESCRIPTOR_SIZE} values, got {vector.size}")
+    return vector
+
+
+def descriptor_blob(descriptor):
+    """Bytes stored in students.face_descriptor"""
+    return descriptor_array(descriptor).tobytes()
+
+
+def face_descriptors(rgb, scale=1.0, model="hog", max_faces=None):
+    """[(descriptor, (top, right, bottom, left))] of the faces in an RGB image.
+
+    Faces are located on the image downscaled by ``scale`` and described at
+    full resolution. Needs face_recognition; also runs in decode processes.
+    """
+    import cv2
+    import face_recognition
+
+    small = rgb if scale == 1.0 else cv2.resize(rgb, None, fx=scale, fy=scale,
+                                               interpolation=cv2.INTER_AREA)
+    locations = [tuple(int(side / scale) for side in box)
+                 for box in face_recognition.face_locations(small, model=model)[:max_faces]]
+    if not locations:
+        return []
+    encodings = face_recognition.face_encodings(rgb, locations)
+    return [(np.asarray(encoding, dtype=np.float32), box) for encoding, box in zip(encodings, locations)]
+
+
+class FaceMatcher:
+    """Enrolled face descriptors in one contiguous float32 matrix.
+
+    ``load()`` reads every stored descriptor once. ``match()`` compares a
+    query against all rows with a single matrix-vector product, using
+    |a - b|^2 = |a|^2 + |b|^2 - 2 a.b with the row norms kept alongside,
+    and accepts the nearest student under ``threshold``. ``add()`` and
+    ``remove()`` keep the matrix in step with enrolments without a reload;
+    rows live in a buffer that grows by doubling, and a removed row is
+    replaced by the last one.
+    """
+
+    def __init__(self, threshold=FACE_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.matrix = np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)
+        self.student_ids = []
+        self.rows = {}
+        self.lock = threading.Lock()
+        self.matches = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def load(self, conn):
+        rows = conn.execute(gate_db.FACE_DESCRIPTORS_SQL).fetchall()
+        matrix = np.empty((max(len(rows), 16), DESCRIPTOR_SIZE), dtype=np.float32)
+        student_ids = []
+        for student_id, blob in rows:
+            try:
+                matrix[len(student_ids)] = descriptor_array(blob)
+            except ValueError as e:
+                print(f"Skipping face descriptor of {student_id}: {str(e)}")
+                continue
+            student_ids.append(student_id)
+        count = len(student_ids)
+        norms = np.zeros(len(matrix), dtype=np.float32)
+        norms[:count] = np.einsum("ij,ij->i", matrix[:count], matrix[:count])
+        with self.lock:
+            self.matrix, self.norms, self.student_ids = matrix, norms, student_ids
+            self.rows = {student_id: row for row, student_id in enumerate(student_ids)}
+        return self
+
+    def add(self, student_id, descriptor):
+        """Enrol or replace the descriptor of ``student_id``"""
+        vector = descriptor_array(descriptor)
+        # Keyed like students.student_id, so numeric-looking ints still match
+        student_id = str(student_id)
+        with self.lock:
+            row = self.rows.get(student_id)
+            if row is None:
+                row = len(self.student_ids)
+                if row == len(self.matrix):
+                    self._grow()
+                self.student_ids.append(student_id)
+                self.rows[student_id] = row
+            self.matrix[row] = vector
+            self.norms[row] = vector @ vector
+
+    def remove(self, student_id):
+        student_id = str(student_id)
+        with self.lock:
+            row = self.rows.pop(student_id, None)
+            if row is None:
+                return
+            last = len(self.student_ids) - 1
+            if row != last:
+                moved = self.student_ids[last]
+                self.matrix[row] = self.matrix[last]
+                self.norms[row] = self.norms[last]
+                self.student_ids[row] = moved
+                self.rows[moved] = row
+            self.student_ids.pop()
+
+    def _grow(self):
+        matrix = np.empty((2 * len(self.matrix) or 16, DESCRIPTOR_SIZE), dtype=np.float32)
+        matrix[:len(self.matrix)] = self.matrix
+        norms = np.zeros(len(matrix), dtype=np.float32)
+        norms[:len(self.norms)] = self.norms
+        self.matrix, self.norms = matrix, norms
+
+    def distances(self, descriptor):
+        """Distance from ``descriptor`` to every enrolled row (in ``student_ids`` order)"""
+        query = descriptor_array(descriptor)
+        with self.lock:
+            count = len(self.student_ids)
+            squared = self.norms[:count] - 2 * (self.matrix[:count] @ query)
+        squared += query @ query
+        return np.sqrt(np.maximum(squared, 0, out=squared), out=squared)
+
+    def nearest(self, query):
+        """(student_id, squared distance) of the row nearest a float32 query, or None if empty"""
+        with self.lock:
+            count = len(self.student_ids)
+            if not count:
+                return None
+            squared = self.norms[:count] - 2 * (self.matrix[:count] @ query)
+            row = int(np.argmin(squared))
+            return self.student_ids[row], float(squared[row] + query @ query)
+
+    def match(self, descriptor):
+        """(student_id, distance) of the nearest enrolled face under the threshold, or None"""
+        return self.accept(self.nearest(descriptor_array(descriptor)))
+
+    def accept(self, nearest):
+        """Apply the threshold to a nearest() result and count the outcome"""
+        distance = float(np.sqrt(max(nearest[1], 0.0))) if nearest else None
+        if distance is None or distance >= self.threshold:
+            self.misses += 1
+            return None
+        self.matches += 1
+        return nearest[0], distance
+
+    def stats(self):
+        return {"enrolled": len(self), "matches": self.matches, "misses": self.misses}
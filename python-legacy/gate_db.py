@@ -0,0 +1,1159 @@
+import sys
+import sqlite3
+import threading
+import queue
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from metrics import METRICS
+
+DB_PATH = 'college_gate_scanner.db'
+
+# Durability setting -> PRAGMA synchronous in WAL mode.
+# "full" fsyncs the WAL on every commit, "normal" only at checkpoints (a commit
+# survives an app crash but the last few may be lost on power failure),
+# "off" leaves flushing to the OS entirely.
+DURABILITY_LEVELS = {
+    "full": "FULL",
+    "normal": "NORMAL",
+    "off": "OFF",
+}
+
+
+def connect(path=DB_PATH, durability="normal", **kwargs):
+    """Open a connection in WAL mode with the given durability"""
+    if durability not in DURABILITY_LEVELS:
+        raise ValueError(f"Unknown durability setting: {durability}")
+    conn = sqlite3.connect(path, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DURABILITY_LEVELS[durability]}")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class KeysetQuery:
+    """A SELECT that is read page by page with keyset pagination.
+
+    Rows are ordered by ``key_columns`` (all descending or all ascending)
+    and every page query returns the key columns first, followed by
+    ``columns``. Continuing after or before a known key uses a row-value
+    comparison on the index instead of OFFSET, so scrolling deep into a
+    large table costs the same as reading the first page. ``where`` may
+    contain placeholders; their values are passed as ``params`` on each call.
+    With ``over_view`` (a UNION ALL view such as gate_logs_all) the count
+    goes through a LIMIT -1 subquery: SQLite does not flatten a compound
+    view into an aggregate, and would otherwise apply subquery conditions
+    only after reading every row of the date range.
+    """
+
+    def __init__(self, columns, from_sql, key_columns, descending=False, where="1", over_view=False):
+        self.columns = columns
+        self.from_sql = from_sql
+        self.key_columns = tuple(key_columns)
+        self.descending = descending
+        self.where = where
+        self.over_view = over_view
+
+    def with_filter(self, condition):
+        """A copy of this query with an extra AND condition"""
+        return KeysetQuery(self.columns, self.from_sql, self.key_columns, self.descending,
+                           f"({self.where}) AND ({condition})", self.over_view)
+
+    def _select(self, condition="", reverse=False):
+        keys = ", ".join(self.key_columns)
+        direction = "DESC" if self.descending != reverse else "ASC"
+        order = ", ".join(f"{column} {direction}" for column in self.key_columns)
+        where = f"({self.where}) AND ({condition})" if condition else self.where
+        return f"SELECT {keys}, {self.columns} FROM {self.from_sql} WHERE {where} ORDER BY {order}"
+
+    @property
+    def count_sql(self):
+        if self.over_view:
+            return f"SELECT COUNT(*) FROM (SELECT 1 FROM {self.from_sql} WHERE {self.where} LIMIT -1)"
+        return f"SELECT COUNT(*) FROM {self.from_sql} WHERE {self.where}"
+
+    @property
+    def page_at_sql(self):
+        return self._select() + " LIMIT ? OFFSET ?"
+
+    @property
+    def page_after_sql(self):
+        keys = ", ".join(self.key_columns)
+        marks = ", ".join("?" for _ in self.key_columns)
+        op = "<" if self.descending else ">"
+        return self._select(f"({keys}) {op} ({marks})") + " LIMIT ?"
+
+    @property
+    def page_before_sql(self):
+        keys = ", ".join(self.key_columns)
+        marks = ", ".join("?" for _ in self.key_columns)
+        op = ">" if self.descending else "<"
+        return self._select(f"({keys}) {op} ({marks})", reverse=True) + " LIMIT ?"
+
+    def count(self, conn, params=()):
+        return conn.execute(self.count_sql, tuple(params)).fetchone()[0]
+
+    def page_at(self, conn, params, offset, limit):
+        """Rows starting at ``offset``; only used to jump, e.g. dragging a scrollbar"""
+        return conn.execute(self.page_at_sql, tuple(params) + (limit, offset)).fetchall()
+
+    def page_after(self, conn, params, key, limit):
+        return conn.execute(self.page_after_sql, tuple(params) + tuple(key) + (limit,)).fetchall()
+
+    def page_before(self, conn, params, key, limit):
+        """Rows just before ``key``, returned in display order"""
+        rows = conn.execute(self.page_before_sql, tuple(params) + tuple(key) + (limit,)).fetchall()
+        rows.reverse()
+        return rows
+
+
+# Hot queries on gate_logs. The app runs these exact statements and
+# check_query_plans() makes sure none of them falls back to a table scan.
+
+OPEN_ENTRIES_SQL = '''
+    SELECT student_id, log_id, entry_time
+    FROM gate_logs
+    WHERE log_date = ? AND exit_time IS NULL
+    ORDER BY log_id
+'''
+
+# Paged views of the Today's Logs and Student Management tabs. Log views
+# read the name and department record_scan copied onto each row, so they
+# never join students and keep showing students deleted since.
+TODAY_LOGS_QUERY = KeysetQuery(
+    "gl.log_id, gl.student_id, gl.student_name, gl.entry_time, gl.exit_time, gl.scan_method, gl.updated_at",
+    "gate_logs gl",
+    ("gl.entry_time", "gl.log_id"), descending=True, where="gl.log_date = ?")
+
+STUDENTS_QUERY = KeysetQuery(
+    "student_id, full_name, department, year, phone, email, status",
+    "students", ("student_id",))
+
+# Logs of the students matching a log_students_fts query, over a range of
+# days in any partition. log_students holds every (ID, name, department)
+# the logs were written with, so deleted students and names used before a
+# rename are found too.
+LOG_SEARCH_QUERY = KeysetQuery(
+    "gl.log_id, gl.student_id, gl.student_name, gl.entry_time, gl.exit_time, gl.scan_method, "
+    "gl.updated_at, gl.log_date",
+    "gate_logs_all gl",
+    ("gl.log_date", "gl.entry_time", "gl.log_id"), descending=True,
+    where="gl.student_id IN (SELECT student_id FROM log_students_fts WHERE log_students_fts MATCH ?) "
+          "AND gl.log_date BETWEEN ? AND ?", over_view=True)
+
+# Same search without FTS5: substring match on log_students
+LOG_SEARCH_LIKE_QUERY = KeysetQuery(
+    LOG_SEARCH_QUERY.columns, LOG_SEARCH_QUERY.from_sql, LOG_SEARCH_QUERY.key_columns,
+    descending=True,
+    where="gl.student_id IN (SELECT student_id FROM log_students "
+          "WHERE student_id || ' ' || student_name || ' ' || department LIKE ?) "
+          "AND gl.log_date BETWEEN ? AND ?", over_view=True)
+
+# Run by record_scan for every entry; a no-op for identities already known
+LOG_STUDENT_SQL = '''
+    INSERT OR IGNORE INTO log_students (student_id, student_name, department)
+    VALUES (?, IFNULL(?, ''), IFNULL(?, ''))
+'''
+
+# Rows of a day inserted or updated after an (updated_at, log_id) cursor.
+# The cursor is strict and breaks ties on log_id, so no row comes back twice.
+LOG_CHANGES_SQL = '''
+    SELECT gl.log_id, gl.student_id, gl.student_name, gl.entry_time, gl.exit_time,
+           gl.scan_method, gl.updated_at
+    FROM gate_logs gl
+    WHERE gl.log_date = ? AND (gl.updated_at, gl.log_id) > (?, ?)
+    ORDER BY gl.updated_at, gl.log_id
+'''
+
+# Where polling a day for changes starts: its last change cursor and newest log_id
+LOG_CHANGES_START_SQL = '''
+    SELECT updated_at, log_id, (SELECT MAX(log_id) FROM gate_logs WHERE log_date = ?)
+    FROM gate_logs
+    WHERE log_date = ?
+    ORDER BY updated_at DESC, log_id DESC
+    LIMIT 1
+'''
+
+# Students with any log on a day; warms DaySummary once per day
+SEEN_STUDENTS_SQL = '''
+    SELECT DISTINCT student_id FROM gate_logs
+    WHERE log_date = ?
+'''
+
+# Counters of one day, kept up to date by record_scan
+DAILY_SUMMARY_SQL = '''
+    SELECT total_entries, total_exits, currently_inside, unique_students
+    FROM daily_summary
+    WHERE log_date = ?
+'''
+
+TODAY_EXPORT_SQL = '''
+    SELECT gl.student_id, gl.student_name, gl.entry_time, gl.exit_time,
+           gl.scan_method, gl.notes
+    FROM gate_logs gl
+    WHERE gl.log_date = ?
+'''
+
+# Raw gate traffic of a date range for exports.ReportExport, across partitions
+REPORT_ROWS_SQL = '''
+    SELECT gl.log_date, gl.student_id,
+           IFNULL(gl.department, 'Unknown') as department,
+           IFNULL(gl.year, 'Unknown') as year,
+           IFNULL(gl.entry_lane, 'Unknown') as lane,
+           gl.entry_time, gl.exit_time,
+           IFNULL(CAST(substr(gl.entry_time, 1, 2) AS INTEGER), -1) as entry_hour,
+           (julianday(gl.exit_time) - julianday(gl.entry_time)) * 1440 as duration_min
+    FROM gate_logs_all gl
+    WHERE gl.log_date BETWEEN ? AND ?
+'''
+
+STUDENTS_EXPORT_SQL = '''
+    SELECT student_id, full_name, department, year, phone, email, status
+    FROM students
+    ORDER BY student_id
+'''
+
+STUDENT_LOOKUP_SQL = '''
+    SELECT student_id, full_name, department, year, status
+    FROM students
+    WHERE student_id = ?
+'''
+
+# Rows that warm the student cache, up to its capacity
+STUDENT_CACHE_WARM_SQL = '''
+    SELECT student_id, full_name, department, year, status
+    FROM students
+    LIMIT ?
+'''
+
+# Editable fields of every student, compared against imported rosters
+STUDENT_FIELDS_SQL = '''
+    SELECT student_id, full_name, department, year, phone, email
+    FROM students
+'''
+
+# Enrolled faces, loaded once into face_match.FaceMatcher
+FACE_DESCRIPTORS_SQL = '''
+    SELECT student_id, face_descriptor
+    FROM students
+    WHERE face_descriptor IS NOT NULL
+'''
+
+# Read from daily_summary, so past days never touch gate_logs
+MONTHLY_REPORT_SQL = '''
+    SELECT log_date, unique_students as total_students, total_entries
+    FROM daily_summary
+    WHERE log_date >= ?
+    ORDER BY log_date
+'''
+
+# Oldest day still in the hot partition before a date; archived next
+OLDEST_LOG_DAY_SQL = '''
+    SELECT MIN(log_date) FROM gate_logs
+    WHERE log_date < ?
+'''
+
+LOG_ARCHIVES_SQL = '''
+    SELECT name FROM sqlite_master
+    WHERE type = 'table' AND name GLOB 'gate_logs_[0-9][0-9][0-9][0-9]_[0-9][0-9]'
+    ORDER BY name
+'''
+
+SUMMARY_ENTRY_SQL = '''
+    INSERT INTO daily_summary
+    (log_date, total_entries, total_exits, currently_inside, unique_students, last_updated)
+    VALUES (?, 1, 0, 1, ?, ?)
+    ON CONFLICT (log_date) DO UPDATE SET
+        total_entries = total_entries + 1,
+        currently_inside = currently_inside + 1,
+        unique_students = unique_students + excluded.unique_students,
+        last_updated = excluded.last_updated
+'''
+
+SUMMARY_EXIT_SQL = '''
+    UPDATE daily_summary
+    SET total_exits = total_exits + 1,
+        currently_inside = currently_inside - 1,
+        last_updated = ?
+    WHERE log_date = ?
+'''
+
+HOT_QUERIES = {
+    "open_entries": (OPEN_ENTRIES_SQL, ("2024-01-01",)),
+    "today_logs_count": (TODAY_LOGS_QUERY.count_sql, ("2024-01-01",)),
+    "today_logs_page": (TODAY_LOGS_QUERY.page_at_sql, ("2024-01-01", 50, 0)),
+    "today_logs_after": (TODAY_LOGS_QUERY.page_after_sql, ("2024-01-01", "12:00:00", 1, 50)),
+    "today_logs_before": (TODAY_LOGS_QUERY.page_before_sql, ("2024-01-01", "12:00:00", 1, 50)),
+    "log_search_count": (LOG_SEARCH_QUERY.count_sql, ('"cs"*', "2024-01-01", "2024-01-31")),
+    "log_search_after": (LOG_SEARCH_QUERY.page_after_sql,
+                         ('"cs"*', "2024-01-01", "2024-01-31", "2024-01-31", "12:00:00", 1, 50)),
+    "log_changes": (LOG_CHANGES_SQL, ("2024-01-01", "2024-01-01T08:00:00", 1)),
+    "log_changes_start": (LOG_CHANGES_START_SQL, ("2024-01-01", "2024-01-01")),
+    "seen_students": (SEEN_STUDENTS_SQL, ("2024-01-01",)),
+    "today_export": (TODAY_EXPORT_SQL, ("2024-01-01",)),
+    "monthly_report": (MONTHLY_REPORT_SQL, ("2024-01-01",)),
+    "report_rows": (REPORT_ROWS_SQL, ("2024-01-01", "2024-12-31")),
+    "oldest_log_day": (OLDEST_LOG_DAY_SQL, ("2024-01-01",)),
+}
+
+
+def create_schema(conn):
+    """Create the base tables of a new database; migrate() adds the rest"""
+    with conn:
+        # Students master table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS students (
+                student_id TEXT PRIMARY KEY,
+                full_name TEXT NOT NULL,
+                department TEXT,
+                year TEXT,
+                phone TEXT,
+                email TEXT,
+                photo_path TEXT,
+                qr_code_path TEXT,
+                status TEXT DEFAULT 'Active',
+                registered_date TEXT
+            )
+        ''')
+
+        # Entry/Exit logs table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS gate_logs (
+                log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT NOT NULL,
+                student_name TEXT,
+                entry_time TEXT,
+                exit_time TEXT,
+                log_date TEXT,
+                duration TEXT,
+                scan_method TEXT,
+                notes TEXT,
+                FOREIGN KEY (student_id) REFERENCES students(student_id)
+            )
+        ''')
+
+        # Daily attendance summary
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS daily_summary (
+                summary_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                log_date TEXT,
+                total_entries INTEGER,
+                total_exits INTEGER,
+                currently_inside INTEGER,
+                last_updated TEXT
+            )
+        ''')
+
+
+def _add_column(conn, table, column, declaration):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        print(f"Added {column} column to {table} table")
+
+
+def _migrate_qr_code_path(conn):
+    _add_column(conn, "students", "qr_code_path", "TEXT")
+
+
+def _migrate_lanes(conn):
+    # Lane columns so multi-camera gates can attribute each scan
+    _add_column(conn, "gate_logs", "entry_lane", "TEXT")
+    _add_column(conn, "gate_logs", "exit_lane", "TEXT")
+
+
+def _migrate_gate_log_indexes(conn):
+    # Partial index: only open entries, used for every entry/exit decision
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_gate_logs_open
+        ON gate_logs (student_id, log_date) WHERE exit_time IS NULL
+    ''')
+    # Covers the per-day views, stats counts and the monthly range scan
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_gate_logs_date
+        ON gate_logs (log_date, entry_time, student_id, exit_time, scan_method)
+    ''')
+    # Bounded sample so this stays quick on a table with millions of rows
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE gate_logs")
+
+
+def _migrate_updated_at(conn):
+    # Last change time of each row, so views can fetch only what changed
+    _add_column(conn, "gate_logs", "updated_at", "TEXT")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_gate_logs_updated
+        ON gate_logs (log_date, updated_at)
+    ''')
+
+
+def _migrate_student_search(conn):
+    # Logs are searched by student, day range first, then newest first
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_gate_logs_student
+        ON gate_logs (student_id, log_date, entry_time)
+    ''')
+    # Full-text index over the searchable student fields, kept in step by triggers
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+                student_id, full_name, department,
+                content='students', content_rowid='rowid'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Student search index not available, falling back to LIKE: {e}")
+        return
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, student_id, full_name, department)
+            VALUES (new.rowid, new.student_id, new.full_name, new.department);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, student_id, full_name, department)
+            VALUES ('delete', old.rowid, old.student_id, old.full_name, old.department);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_fts_update AFTER UPDATE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, student_id, full_name, department)
+            VALUES ('delete', old.rowid, old.student_id, old.full_name, old.department);
+            INSERT INTO students_fts (rowid, student_id, full_name, department)
+            VALUES (new.rowid, new.student_id, new.full_name, new.department);
+        END
+    ''')
+    conn.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+def _migrate_daily_summary(conn):
+    # One row per day, rebuilt from the logs and from here on kept by record_scan
+    _add_column(conn, "daily_summary", "unique_students", "INTEGER")
+    conn.execute("DELETE FROM daily_summary")
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_summary_date
+        ON daily_summary (log_date)
+    ''')
+    conn.execute('''
+        INSERT INTO daily_summary
+        (log_date, total_entries, total_exits, currently_inside, unique_students, last_updated)
+        SELECT log_date, COUNT(*), COUNT(exit_time), COUNT(*) - COUNT(exit_time),
+               COUNT(DISTINCT student_id), ?
+        FROM gate_logs
+        WHERE log_date IS NOT NULL
+        GROUP BY log_date
+    ''', (datetime.now().isoformat(),))
+
+
+def _migrate_face_descriptor(conn):
+    # 128 float32 values per enrolled face, see face_match
+    _add_column(conn, "students", "face_descriptor", "BLOB")
+
+
+def _migrate_log_student_fields(conn):
+    # Student fields as of the scan, written once by record_scan, so log
+    # views and reports read gate_logs alone
+    _add_column(conn, "gate_logs", "department", "TEXT")
+    _add_column(conn, "gate_logs", "year", "TEXT")
+    # Backfill older rows from the students that still exist
+    cursor = conn.execute('''
+        UPDATE gate_logs
+        SET (student_name, department, year) = (
+            SELECT IFNULL(gate_logs.student_name, s.full_name), s.department, s.year
+            FROM students s
+            WHERE s.student_id = gate_logs.student_id)
+        WHERE department IS NULL
+          AND student_id IN (SELECT student_id FROM students)
+    ''')
+    print(f"Copied student fields onto {cursor.rowcount} gate_logs rows")
+
+
+def _migrate_log_partitions(conn):
+    # gate_logs_all: the hot partition and every month archive, see archive_log_day
+    refresh_log_view(conn)
+
+
+def _migrate_log_search(conn):
+    # Every (ID, name, department) the logs were written with, so log search
+    # does not depend on the current students table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_students (
+            student_id TEXT NOT NULL,
+            student_name TEXT NOT NULL,
+            department TEXT NOT NULL,
+            PRIMARY KEY (student_id, student_name, department)
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO log_students (student_id, student_name, department)
+        SELECT DISTINCT student_id, IFNULL(student_name, ''), IFNULL(department, '')
+        FROM gate_logs_all
+    ''')
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS log_students_fts USING fts5(
+                student_id, student_name, department,
+                content='log_students', content_rowid='rowid'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Log search index not available, falling back to LIKE: {e}")
+        return
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_students_fts_insert AFTER INSERT ON log_students BEGIN
+            INSERT INTO log_students_fts (rowid, student_id, student_name, department)
+            VALUES (new.rowid, new.student_id, new.student_name, new.department);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_students_fts_delete AFTER DELETE ON log_students BEGIN
+            INSERT INTO log_students_fts (log_students_fts, rowid, student_id, student_name, department)
+            VALUES ('delete', old.rowid, old.student_id, old.student_name, old.department);
+        END
+    ''')
+    conn.execute("INSERT INTO log_students_fts (log_students_fts) VALUES ('rebuild')")
+
+
+def _migrate_drop_student_search(conn):
+    # Log search reads log_students_fts now; nothing reads students_fts,
+    # and its triggers only slowed down every student write
+    for trigger in ("students_fts_insert", "students_fts_delete", "students_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS students_fts")
+
+
+# Applied in order; PRAGMA user_version records how many have run.
+# Every step must also be safe on databases created before this list existed.
+# A step that adds gate_logs columns must end with refresh_log_view(conn).
+MIGRATIONS = [
+    _migrate_qr_code_path,
+    _migrate_lanes,
+    _migrate_gate_log_indexes,
+    _migrate_updated_at,
+    _migrate_student_search,
+    _migrate_daily_summary,
+    _migrate_face_descriptor,
+    _migrate_log_student_fields,
+    _migrate_log_partitions,
+    _migrate_log_search,
+    _migrate_drop_student_search,
+]
+
+
+def migrate(conn):
+    """Bring the schema up to date, one transaction per migration"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        print(f"Applied database migration {number}: {migration.__name__}")
+
+
+def has_log_search(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'log_students_fts'").fetchone() is not None
+
+
+def log_search(conn, text, since, until):
+    """(query, params) for the logs of students matching ``text`` between two dates.
+
+    Every word of ``text`` must prefix-match the student's ID, or a name
+    or department the student was logged with, so typing part of a name
+    already narrows the results.
+    """
+    # Punctuation-only words have no tokens and would match nothing
+    words = [word for word in text.split() if any(ch.isalnum() for ch in word)]
+    if words and has_log_search(conn):
+        match = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+        return LOG_SEARCH_QUERY, (match, since, until)
+    return LOG_SEARCH_LIKE_QUERY, (f"%{text.strip()}%", since, until)
+
+
+def log_archive_name(month):
+    """Archive table of a month, e.g. gate_logs_2024_01 for 2024-01"""
+    # Table names are built from this, so only real months get through
+    datetime.strptime(month, "%Y-%m")
+    return "gate_logs_" + month.replace("-", "_")
+
+
+def log_archives(conn):
+    """[(month, table)] of the archived months, oldest first"""
+    return [(name[10:14] + "-" + name[15:17], name) for (name,) in conn.execute(LOG_ARCHIVES_SQL)]
+
+
+def log_archive(conn, month):
+    """The archive table of ``month``, created if needed with every gate_logs column.
+
+    Archives are read-only once written, so they are WITHOUT ROWID tables
+    clustered on (log_date, log_id): a date range is one contiguous run of
+    pages, and rows copied in that order pack the pages full.
+    """
+    table = log_archive_name(month)
+    columns = [(row[1], row[2]) for row in conn.execute("PRAGMA table_info(gate_logs)")]
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            {", ".join(f"{name} {declared}" for name, declared in columns)},
+            PRIMARY KEY (log_date, log_id)
+        ) WITHOUT ROWID
+    ''')
+    # Rows archived before a later migration added a column read it as NULL
+    for name, declared in columns:
+        _add_column(conn, table, name, declared)
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{table}_student
+        ON {table} (student_id, log_date, entry_time)
+    ''')
+    return table
+
+
+def refresh_log_view(conn):
+    """(Re)create gate_logs_all, the hot partition and every archive as one table"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(gate_logs)")]
+    selects = [f"SELECT {', '.join(columns)} FROM gate_logs"]
+    for month, table in log_archives(conn):
+        archived = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        selects.append("SELECT " + ", ".join(column if column in archived else f"NULL AS {column}"
+                                             for column in columns) + f" FROM {table}")
+    conn.execute("DROP VIEW IF EXISTS gate_logs_all")
+    conn.execute("CREATE VIEW gate_logs_all AS " + " UNION ALL ".join(selects))
+
+
+def check_query_plans(conn):
+    """Return (query, plan step) pairs for hot queries that scan gate_logs"""
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        try:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # e.g. log_students_fts missing when SQLite was built without FTS5
+            problems.append((name, str(e)))
+            continue
+        for row in plan:
+            detail = row[-1]
+            words = detail.split()
+            # "SCAN gl" / "SCAN TABLE gate_logs AS gl" but not "SCAN gl USING ... INDEX";
+            # archives (gate_logs_2024_01) count too
+            if words and words[0] == "SCAN" and "INDEX" not in words \
+                    and any(word == "gl" or word.startswith("gate_logs") for word in words):
+                problems.append((name, detail))
+    return problems
+
+
+class OpenEntryIndex:
+    """In-memory map of student_id -> (log_id, entry_time) for open entries.
+
+    Holds the entries of one log_date that have no exit yet, so deciding
+    between entry and exit never has to query gate_logs. It is warmed from
+    the database for the current day and then kept in step by the write
+    jobs, which all run on the single writer thread. A new log_date (the
+    midnight rollover) rebuilds it from the database, and so does any
+    transaction the writer has to roll back. Writes made by another process
+    are not seen until the next rebuild.
+    """
+
+    def __init__(self):
+        self.log_date = None
+        self.entries = {}
+        self.rebuilds = 0
+
+    def warm(self, conn, log_date):
+        # ORDER BY log_id: if old data has several open rows, the newest wins
+        self.entries = {student_id: (log_id, entry_time)
+                        for student_id, log_id, entry_time in conn.execute(OPEN_ENTRIES_SQL, (log_date,))}
+        self.log_date = log_date
+        self.rebuilds += 1
+
+    def for_day(self, conn, log_date):
+        """The open entries of ``log_date``, rebuilt if the day has changed"""
+        if log_date != self.log_date:
+            self.warm(conn, log_date)
+        return self.entries
+
+    def invalidate(self):
+        self.log_date = None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DaySummary:
+    """In-memory mirror of one day's daily_summary row.
+
+    record_scan updates the row and this mirror in the same write job, so
+    today's statistics never need a COUNT over gate_logs. ``seen`` holds
+    the students already logged that day, which tells whether an entry adds
+    to unique_students. Like OpenEntryIndex it lives on the writer thread
+    and is rebuilt for a new day or after a rolled-back batch.
+    """
+
+    def __init__(self):
+        self.log_date = None
+        self.total_entries = 0
+        self.total_exits = 0
+        self.seen = set()
+
+    def warm(self, conn, log_date):
+        row = conn.execute(DAILY_SUMMARY_SQL, (log_date,)).fetchone()
+        self.total_entries, self.total_exits = (row[0], row[1]) if row else (0, 0)
+        self.seen = {student_id for (student_id,) in conn.execute(SEEN_STUDENTS_SQL, (log_date,))}
+        self.log_date = log_date
+
+    def for_day(self, conn, log_date):
+        """This summary moved to ``log_date`` if the day has changed"""
+        if log_date != self.log_date:
+            self.warm(conn, log_date)
+        return self
+
+    def invalidate(self):
+        self.log_date = None
+
+    def counts(self):
+        return {
+            "total_entries": self.total_entries,
+            "total_exits": self.total_exits,
+            "currently_inside": self.total_entries - self.total_exits,
+            "unique_students": len(self.seen),
+        }
+
+
+class StudentCache:
+    """Bounded LRU of student rows as returned by STUDENT_LOOKUP_SQL.
+
+    Warmed with up to ``capacity`` students at startup. When the whole
+    table fits, the cache is complete: an ID it does not hold is unknown
+    and answered without a query. Otherwise a miss reads the row and
+    caches it, evicting the least recently used. Writes to students are
+    reported through ``invalidate()``; an invalidated ID is re-read on its
+    next lookup, and a read that raced with an invalidation is not cached.
+    IDs written by the batch in progress are marked with ``writing()``
+    and always read, so the writer connection sees its own uncommitted rows.
+    Lookups may come from any thread, each passing its own connection.
+    """
+
+    def __init__(self, capacity=50000):
+        self.capacity = capacity
+        self.rows = OrderedDict()
+        self.complete = False
+        # IDs written since warming that a complete cache must re-read
+        self.stale = set()
+        # IDs written by the batch the writer is running, not yet committed
+        self.written = set()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.unknown = 0
+        self.invalidations = 0
+
+    def warm(self, conn):
+        rows = conn.execute(STUDENT_CACHE_WARM_SQL, (self.capacity + 1,)).fetchall()
+        with self.lock:
+            self.rows = OrderedDict((row[0], row) for row in rows[:self.capacity])
+            self.complete = len(rows) <= self.capacity
+            self.stale = set()
+            self.generation += 1
+
+    def get(self, conn, student_id):
+        """The student's row, or None if there is no such student"""
+        with self.lock:
+            row = self.rows.get(student_id) if student_id not in self.written else None
+            if row is not None:
+                self.rows.move_to_end(student_id)
+                self.hits += 1
+                return row
+            if self.complete and student_id not in self.stale and student_id not in self.written:
+                self.unknown += 1
+                return None
+            self.misses += 1
+            generation = self.generation
+        row = conn.execute(STUDENT_LOOKUP_SQL, (student_id,)).fetchone()
+        with self.lock:
+            if generation == self.generation and student_id not in self.written:
+                self.stale.discard(student_id)
+                if row is not None:
+                    self.rows[student_id] = row
+                    if len(self.rows) > self.capacity:
+                        self.rows.popitem(last=False)
+                        self.complete = False
+        return row
+
+    def writing(self, student_ids):
+        with self.lock:
+            self.written.update(student_ids)
+            self.generation += 1
+
+    def invalidate(self, student_ids):
+        with self.lock:
+            for student_id in student_ids:
+                self.written.discard(student_id)
+                self.rows.pop(student_id, None)
+                if self.complete:
+                    self.stale.add(student_id)
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.unknown
+            return {
+                "cached": len(self.rows),
+                "complete": self.complete,
+                "hits": self.hits,
+                "misses": self.misses,
+                "unknown": self.unknown,
+                "hit_rate": round((self.hits + self.unknown) / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+def written_students(job):
+    """IDs of the students a write job changes, for StudentCache.invalidate"""
+    # As strings: the cache is keyed by the TEXT student_id
+    if job.func in (insert_student, update_student):
+        return [str(job.args[0]["id"])]
+    if job.func is delete_student:
+        return [str(job.args[0])]
+    if job.func is upsert_students:
+        return [str(student["id"]) for student in job.args[0]]
+    return []
+
+
+class WriteJob:
+    """A write queued for the writer thread"""
+
+    def __init__(self, func, args, callback=None):
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the job is committed and return its result"""
+        if not self.done.wait(timeout):
+            raise TimeoutError("Database write did not complete in time")
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class DbWriter(threading.Thread):
+    """Single writer thread that group-commits queued writes.
+
+    ``submit(func, *args)`` queues ``func(conn, *args)``. The thread takes
+    every job that arrives within ``commit_window`` seconds of the first
+    one (up to ``max_batch``) and commits them in one transaction, so a
+    burst of scans costs one fsync instead of one each. Each job runs in
+    its own savepoint, so a failing job does not undo the rest of the
+    batch. Confirmations for jobs with a callback are queued on
+    ``confirmations`` as (callback, result, error) for the UI thread to run.
+    Functions in ``batch_listeners`` and ``commit_listeners`` are called on
+    the writer thread with every batch of jobs, before it runs and once it
+    has finished, and must return quickly.
+    """
+
+    def __init__(self, path=DB_PATH, durability="normal", commit_window=0.005, max_batch=500):
+        super().__init__(name="db-writer", daemon=True)
+        self.path = path
+        self.durability = durability
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.confirmations = queue.Queue()
+        self.ready = threading.Event()
+        # Called on the writer thread when a batch is rolled back, so
+        # in-memory state kept in step with the writes can be rebuilt
+        self.rollback_hooks = []
+        self.batch_listeners = []
+        self.commit_listeners = []
+        self.batches = 0
+        self.jobs_done = 0
+        self.commit_seconds = 0.0
+
+    def submit(self, func, *args, callback=None):
+        job = WriteJob(func, args, callback)
+        self.jobs.put(job)
+        return job
+
+    def call(self, func, *args, timeout=30):
+        """Run a write on the writer thread and wait for its commit"""
+        return self.submit(func, *args).wait(timeout)
+
+    def stop(self):
+        """Commit everything still queued and stop the thread"""
+        self.jobs.put(None)
+        self.join(timeout=10)
+
+    def run(self):
+        conn = connect(self.path, self.durability, isolation_level=None)
+        self.ready.set()
+        stopping = False
+        try:
+            while not stopping:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                batch = [job]
+                deadline = time.monotonic() + self.commit_window
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self.jobs.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stopping = True
+                        break
+                    batch.append(job)
+                self.run_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def run_batch(self, conn, batch):
+        for listener in self.batch_listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                print(f"Error in batch listener: {str(e)}")
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                job_start = time.perf_counter()
+                conn.execute("SAVEPOINT job")
+                try:
+                    job.result = job.func(conn, *job.args)
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    job.error = e
+                METRICS.observe(f"db.write.{job.func.__name__}", 1000 * (time.perf_counter() - job_start))
+            commit_start = time.perf_counter()
+            conn.execute("COMMIT")
+            METRICS.observe("db.commit", 1000 * (time.perf_counter() - commit_start))
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job in batch:
+                job.error = job.error or e
+            for hook in self.rollback_hooks:
+                hook()
+        self.commit_seconds += time.perf_counter() - start
+        METRICS.observe("db.batch", 1000 * (time.perf_counter() - start))
+        METRICS.count("db.jobs", len(batch))
+        self.batches += 1
+        self.jobs_done += len(batch)
+        for job in batch:
+            job.done.set()
+            if job.callback:
+                self.confirmations.put((job.callback, job.result, job.error))
+        for listener in self.commit_listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                print(f"Error in commit listener: {str(e)}")
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "jobs": self.jobs_done,
+            "avg_batch": self.jobs_done / self.batches if self.batches else 0.0,
+            "avg_commit_ms": 1000 * self.commit_seconds / self.batches if self.batches else 0.0,
+            "queued": self.jobs.qsize(),
+        }
+
+
+# Write jobs. Each runs on the writer connection inside the batch transaction.
+
+def record_scan(conn, open_entries, summary, student_id, scan_method, lane, scanned_at, students=None):
+    """Log an entry, or an exit if the student has an open entry today.
+
+    An entry copies the student's name, department and year onto the new
+    row, from ``students`` (a StudentCache) when given. Unknown IDs are
+    logged with NULLs.
+    """
+    current_time = scanned_at.strftime("%H:%M:%S")
+    today = scanned_at.strftime("%Y-%m-%d")
+    updated_at = datetime.now().isoformat()
+    if students:
+        student = students.get(conn, student_id)
+    else:
+        student = conn.execute(STUDENT_LOOKUP_SQL, (student_id,)).fetchone()
+    student_name = student[1] if student else None
+    entries = open_entries.for_day(conn, today)
+    summary.for_day(conn, today)
+    existing_entry = entries.get(student_id)
+    if existing_entry:
+        log_id, entry_time = existing_entry
+        conn.execute('''
+            UPDATE gate_logs
+            SET exit_time = ?, scan_method = ?, exit_lane = ?, updated_at = ?
+            WHERE log_id = ?
+        ''', (current_time, scan_method, lane, updated_at, log_id))
+        conn.execute(SUMMARY_EXIT_SQL, (updated_at, today))
+        del entries[student_id]
+        summary.total_exits += 1
+        return {"action": "exit", "log_id": log_id, "student_id": student_id, "student_name": student_name,
+                "entry_time": entry_time, "exit_time": current_time,
+                "scan_method": scan_method, "log_date": today, "summary": summary.counts()}
+    conn.execute(LOG_STUDENT_SQL, (student_id, student_name, student[2] if student else None))
+    cursor = conn.execute('''
+        INSERT INTO gate_logs
+        (student_id, student_name, department, year, entry_time, log_date,
+         scan_method, entry_lane, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (student_id, student_name, student[2] if student else None, student[3] if student else None,
+          current_time, today, scan_method, lane, updated_at))
+    first_visit = student_id not in summary.seen
+    conn.execute(SUMMARY_ENTRY_SQL, (today, int(first_visit), updated_at))
+    entries[student_id] = (cursor.lastrowid, current_time)
+    summary.total_entries += 1
+    summary.seen.add(student_id)
+    return {"action": "entry", "log_id": cursor.lastrowid, "student_id": student_id, "student_name": student_name,
+            "entry_time": current_time, "exit_time": None,
+            "scan_method": scan_method, "log_date": today, "summary": summary.counts()}
+
+
+def insert_student(conn, student_data, qr_path):
+    conn.execute('''
+        INSERT INTO students (student_id, full_name, department, year,
+                            phone, email, qr_code_path, registered_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (student_data["id"], student_data["name"], student_data["dept"],
+         student_data["year"], student_data["phone"], student_data["email"],
+         qr_path, datetime.now().strftime("%Y-%m-%d")))
+
+
+def upsert_students(conn, students):
+    """Insert or update many students in the writer's transaction"""
+    registered = datetime.now().strftime("%Y-%m-%d")
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, department, year,
+                            phone, email, registered_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (student_id) DO UPDATE SET
+            full_name = excluded.full_name,
+            department = excluded.department,
+            year = excluded.year,
+            phone = excluded.phone,
+            email = excluded.email
+    ''', [(student["id"], student["name"], student["dept"], student["year"],
+           student["phone"], student["email"], registered)
+          for student in students])
+
+
+def update_student(conn, student_data):
+    conn.execute('''
+        UPDATE students
+        SET full_name=?, department=?, year=?, phone=?, email=?
+        WHERE student_id=?
+    ''', (student_data["name"], student_data["dept"], student_data["year"],
+          student_data["phone"], student_data["email"], student_data["id"]))
+
+
+def delete_student(conn, student_id):
+    conn.execute("DELETE FROM students WHERE student_id=?", (student_id,))
+
+
+def set_face_descriptor(conn, student_id, descriptor):
+    cursor = conn.execute("UPDATE students SET face_descriptor = ? WHERE student_id = ?",
+                          (descriptor, student_id))
+    if not cursor.rowcount:
+        raise ValueError(f"No student with ID {student_id}")
+
+
+def delete_all_logs(conn, open_entries, summary):
+    conn.execute("DELETE FROM gate_logs")
+    conn.execute("DELETE FROM daily_summary")
+    conn.execute("DELETE FROM log_students")
+    for month, table in log_archives(conn):
+        conn.execute(f"DROP TABLE {table}")
+    refresh_log_view(conn)
+    open_entries.entries.clear()
+    summary.invalidate()
+
+
+def archive_log_day(conn, before):
+    """Move the oldest day logged before ``before`` from gate_logs into its month archive.
+
+    Returns (log_date, rows moved), or None once no day before ``before``
+    is left in the hot partition. One day per job keeps each write short,
+    so archiving a month never holds up the scans queued behind it.
+    """
+    log_date = conn.execute(OLDEST_LOG_DAY_SQL, (before,)).fetchone()[0]
+    if log_date is None:
+        return None
+    archives = len(log_archives(conn))
+    table = log_archive(conn, log_date[:7])
+    columns = ", ".join(row[1] for row in conn.execute("PRAGMA table_info(gate_logs)"))
+    conn.execute(f'''
+        INSERT INTO {table} ({columns})
+        SELECT {columns} FROM gate_logs
+        WHERE log_date = ?
+        ORDER BY log_id
+    ''', (log_date,))
+    cursor = conn.execute("DELETE FROM gate_logs WHERE log_date = ?", (log_date,))
+    if len(log_archives(conn)) != archives:
+        refresh_log_view(conn)
+    return log_date, cursor.rowcount
+
+
+def drop_log_archives(conn, before_month):
+    """Drop the archives of months before ``before_month`` ("YYYY-MM").
+
+    Their daily_summary rows stay, so monthly reports keep the counts.
+    Returns the months dropped.
+    """
+    log_archive_name(before_month)
+    dropped = [month for month, table in log_archives(conn) if month < before_month]
+    for month in dropped:
+        conn.execute(f"DROP TABLE {log_archive_name(month)}")
+    if dropped:
+        refresh_log_view(conn)
+    return dropped
+
+
+def print_log_partitions(conn):
+    for name in ["gate_logs"] + [table for month, table in log_archives(conn)]:
+        print(f"{name}: {conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]} rows")
+
+
+if __name__ == "__main__":
+    # python gate_db.py --check-plans [database]
+    # python gate_db.py --archive [database]               archive every closed month
+    # python gate_db.py --drop-archives YYYY-MM [database]  drop archives before a month
+    if len(sys.argv) >= 2 and sys.argv[1] in ("--archive", "--drop-archives"):
+        args = sys.argv[3:] if sys.argv[1] == "--drop-archives" else sys.argv[2:]
+        conn = sqlite3.connect(args[0] if args else DB_PATH)
+        migrate(conn)
+        conn.isolation_level = None
+        if sys.argv[1] == "--archive":
+            before = datetime.now().strftime("%Y-%m-01")
+            while True:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    moved = archive_log_day(conn, before)
+                if moved is None:
+                    break
+                print(f"Archived {moved[1]} rows of {moved[0]}")
+        else:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                dropped = drop_log_archives(conn, sys.argv[2])
+            print(f"Dropped the archives of {', '.join(dropped) or 'no months'}")
+        print_log_partitions(conn)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--check-plans":
+        conn = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else DB_PATH)
+        migrate(conn)
+        problems = check_query_plans(conn)
+        for name, detail in problems:
+            print(f"FAIL {name}: {detail}")
+        if problems:
+            sys.exit(1)
+        print(f"OK: {len(HOT_QUERIES)} hot queries use indexes")
+    else:
+        print("Usage: python gate_db.py --check-plans | --archive | --drop-archives YYYY-MM [database]")
@@ -0,0 +1,392 @@
+import argparse
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import date, datetime
+
+import gate_db
+from face_index import IvfFaceIndex, face_index_path, open_face_index
+from face_match import FaceMatcher, descriptor_blob
+from metrics import METRICS
+from scan_api import ScanApiServer, parse_address
+
+# Optional imports for the camera lanes
+try:
+    import cv2
+    from qr_pipeline import ScanPipeline, DebounceTable, RecordedCamera
+    QR_AVAILABLE = True
+except Exception:
+    QR_AVAILABLE = False
+
+
+# Scan method recorded for each kind of code the pipeline reports
+SCAN_METHODS = {"qr": "QR", "face": "Face"}
+
+# Gate settings, shared by the GUI and the headless entry point at the end of this file
+# "multiscale" decodes a downscaled grayscale frame first; "full" decodes every frame at 1280x720
+QR_DECODE_MODE = "multiscale"
+# Scanner modes offered when face_recognition is installed: label -> decode mode
+SCANNER_MODES = {"QR code": QR_DECODE_MODE, "Face": "face"}
+
+# Scanner loop rates: full rate while something moves in view, low rate when the gate is idle
+QR_SCHEDULER_SETTINGS = {
+    "active_decode_fps": 15,
+    "idle_decode_fps": 2,
+    "active_preview_fps": 25,
+    "idle_preview_fps": 4,
+}
+
+# One camera per gate lane, e.g. GATE_CAMERAS="0,1,2,3" (device indexes or stream URLs)
+CAMERA_SOURCES = [int(src) if src.strip().isdigit() else src.strip()
+                  for src in os.environ.get("GATE_CAMERAS", "0").split(",") if src.strip()]
+LANE_NAMES = [f"Lane {idx + 1}" for idx in range(len(CAMERA_SOURCES))]
+
+# "full", "normal" or "off"; see gate_db.DURABILITY_LEVELS
+DB_DURABILITY = os.environ.get("GATE_DB_DURABILITY", "normal")
+# Scans arriving within this many seconds are committed together
+DB_COMMIT_WINDOW = 0.005
+
+# HTTP/WebSocket scan API for handheld scanners and turnstiles, e.g.
+# GATE_API="0.0.0.0:8765"; off when unset. With GATE_API_TOKEN set, clients
+# must send it as "Authorization: Bearer <token>"
+SCAN_API_ADDRESS = os.environ.get("GATE_API", "")
+SCAN_API_TOKEN = os.environ.get("GATE_API_TOKEN") or None
+
+
+class GateService:
+    """The gate without a GUI: database, entry/exit decisions and camera lanes.
+
+    ``open()`` creates and migrates the database, warms the in-memory
+    open-entry index and daily counters, and starts the DB writer thread.
+    Logs of closed months are moved to their archives in the background,
+    at startup and whenever scans roll over into a new month.
+    Scans are submitted to the writer; callbacks given with them are run by
+    ``run_confirmations()``, which the owner calls from its own thread (the
+    Tk loop or the headless loop). Reads on ``conn`` belong to the thread
+    that called ``open()``. Errors are raised, never shown: presenting
+    them is up to the client.
+    """
+
+    def __init__(self, db_path=gate_db.DB_PATH, durability="normal", commit_window=0.005,
+                 debounce_window=3, student_cache_size=50000):
+        self.db_path = db_path
+        self.durability = durability
+        self.commit_window = commit_window
+        self.conn = None
+        self.db_writer = None
+        self.open_entries = gate_db.OpenEntryIndex()
+        self.day_summary = gate_db.DaySummary()
+        self.face_matcher = FaceMatcher()
+        self.student_cache = gate_db.StudentCache(student_cache_size)
+        # Month whose logs are written to the hot partition; older ones get archived
+        self.log_month = None
+        self.log_archiver = None
+        self.archiving = threading.Event()
+        self.cameras = {}
+        self.pipeline = None
+        # Repeat reads of the same code are ignored for a few seconds; other IDs pass immediately
+        self.debounce = DebounceTable(window=debounce_window) if QR_AVAILABLE else None
+
+    def open(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        # WAL mode: this connection only reads once the writer thread is up
+        self.conn = gate_db.connect(self.db_path, self.durability)
+        gate_db.create_schema(self.conn)
+        gate_db.migrate(self.conn)
+        for name, detail in gate_db.check_query_plans(self.conn):
+            print(f"Warning: query '{name}' scans gate_logs: {detail}")
+
+        today = date.today().strftime("%Y-%m-%d")
+        self.log_month = today[:7]
+        self.open_entries.warm(self.conn, today)
+        self.day_summary.warm(self.conn, today)
+        self.student_cache.warm(self.conn)
+        # Brute force for a few thousand faces, the IVF index saved next to the database beyond
+        self.face_matcher = open_face_index(self.conn, face_index_path(self.db_path))
+
+        # All writes from here on go through one thread that group-commits them
+        self.db_writer = gate_db.DbWriter(self.db_path, self.durability, self.commit_window)
+        self.db_writer.rollback_hooks.append(self.open_entries.invalidate)
+        self.db_writer.rollback_hooks.append(self.day_summary.invalidate)
+        # Registrations, edits, deletions and imports all go through the writer
+        self.db_writer.batch_listeners.append(self.mark_students_written)
+        self.db_writer.commit_listeners.append(self.invalidate_students)
+        self.db_writer.commit_listeners.append(self.archive_on_rollover)
+        self.db_writer.start()
+        self.archive_logs()
+        return self
+
+    def close(self):
+        self.stop_cameras()
+        if self.log_archiver:
+            self.archiving.clear()
+            self.log_archiver.join(timeout=10)
+            self.log_archiver = None
+        if self.db_writer:
+            self.db_writer.stop()
+            # Callbacks of the writes committed while stopping
+            self.run_confirmations()
+            print(f"Database writer stats: {self.db_writer.stats()}")
+            print(f"Hot path timings: {METRICS.summary()}")
+            print(f"Student cache stats: {self.student_cache.stats()}")
+            self.db_writer = None
+        if isinstance(self.face_matcher, IvfFaceIndex):
+            print(f"Face index stats: {self.face_matcher.stats()}")
+            self.face_matcher.save()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    # --- Scans ---
+
+    def lookup_student(self, student_id):
+        """(student_id, full_name, department, year, status) or None, usually from the cache"""
+        with METRICS.span("db.lookup"):
+            return self.student_cache.get(self.conn, student_id)
+
+    def mark_students_written(self, batch):
+        student_ids = [student_id for job in batch for student_id in gate_db.written_students(job)]
+        if student_ids:
+            self.student_cache.writing(student_ids)
+
+    def invalidate_students(self, batch):
+        student_ids = [student_id for job in batch for student_id in gate_db.written_students(job)]
+        if student_ids:
+            self.student_cache.invalidate(student_ids)
+
+    def submit_scan(self, student_id, scan_method, lane=None, callback=None, scanned_at=None):
+        """Queue an entry/exit for ``student_id``; the decision is made on the writer thread.
+
+        ``scanned_at`` defaults to now; replays of recorded traffic pass their own.
+        """
+        return self.db_writer.submit(gate_db.record_scan, self.open_entries, self.day_summary,
+                                     student_id, scan_method, lane, scanned_at or datetime.now(),
+                                     self.student_cache, callback=callback)
+
+    def run_confirmations(self):
+        """Run callbacks of committed writes on the calling thread"""
+        while True:
+            try:
+                callback, result, error = self.db_writer.confirmations.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(result, error)
+            except Exception as e:
+                print(f"Error in write confirmation: {str(e)}")
+
+    def add_scan_listener(self, listener):
+        """Call ``listener(jobs)`` after each commit with its record_scan jobs, from any client.
+
+        Runs on the writer thread; each job has ``args``, ``result`` and ``error``.
+        """
+        def on_commit(batch):
+            jobs = [job for job in batch if job.func is gate_db.record_scan]
+            if jobs:
+                listener(jobs)
+        self.db_writer.commit_listeners.append(on_commit)
+
+    def today_stats(self):
+        row = self.conn.execute(gate_db.DAILY_SUMMARY_SQL, (date.today().strftime("%Y-%m-%d"),)).fetchone()
+        if not row:
+            return {"total_entries": 0, "total_exits": 0, "currently_inside": 0, "unique_students": 0}
+        return {"total_entries": row[0], "total_exits": row[1],
+                "currently_inside": row[2], "unique_students": row[3]}
+
+    # --- Students and logs ---
+
+    def register_student(self, student_data):
+        self.db_writer.call(gate_db.insert_student, student_data, None)
+        if student_data.get("face_descriptor") is not None:
+            self.enroll_face(student_data["id"], student_data["face_descriptor"])
+
+    def update_student(self, student_data):
+        self.db_writer.call(gate_db.update_student, student_data)
+        if student_data.get("face_descriptor") is not None:
+            self.enroll_face(student_data["id"], student_data["face_descriptor"])
+
+    def delete_student(self, student_id):
+        student_id = str(student_id)
+        self.db_writer.call(gate_db.delete_student, student_id)
+        self.face_matcher.remove(student_id)
+
+    def enroll_face(self, student_id, descriptor):
+        """Store a student's 128-d face descriptor and make it matchable at once"""
+        self.db_writer.call(gate_db.set_face_descriptor, student_id, descriptor_blob(descriptor))
+        self.face_matcher.add(student_id, descriptor)
+
+    def delete_all_logs(self):
+        self.db_writer.call(gate_db.delete_all_logs, self.open_entries, self.day_summary)
+
+    def drop_log_archives(self, before_month):
+        """Drop the archived logs of months before ``before_month`` ("YYYY-MM")"""
+        return self.db_writer.call(gate_db.drop_log_archives, before_month)
+
+    def archive_logs(self):
+        """Start moving the logs of months before ``log_month`` to their archives"""
+        if self.log_archiver and self.log_archiver.is_alive():
+            return
+        self.archiving.set()
+        self.log_archiver = threading.Thread(target=self.run_log_archiver, name="log-archiver", daemon=True)
+        self.log_archiver.start()
+
+    def run_log_archiver(self):
+        # One day per write job, so scans queue behind a short job at most.
+        # log_month is re-read each time in case a rollover happens meanwhile.
+        days, rows = 0, 0
+        try:
+            while self.archiving.is_set():
+                before = self.log_month + "-01"
+                moved = self.db_writer.call(gate_db.archive_log_day, before)
+                if moved:
+                    days += 1
+                    rows += moved[1]
+                elif before == self.log_month + "-01":
+                    break
+        except Exception as e:
+            print(f"Log archiving stopped: {str(e)}")
+        if days:
+            print(f"Archived {rows} log rows of {days} days before {self.log_month}")
+
+    def archive_on_rollover(self, batch):
+        """Commit listener: the first scan of a new month archives the month before"""
+        for job in batch:
+            if job.func is not gate_db.record_scan or job.error or not job.result:
+                continue
+            if job.result["log_date"][:7] > self.log_month:
+                self.log_month = job.result["log_date"][:7]
+                self.archive_logs()
+
+    # --- Camera lanes ---
+
+    def start_cameras(self, sources, decode_mode="multiscale", scheduler_settings=None):
+        """Open one camera per lane ({lane: source}) and start decoding.
+
+        A source that is a video file is played back at its own frame rate,
+        as if the recorded traffic were in front of the gate again.
+        Returns the lanes whose camera could not be opened; raises if none could.
+        """
+        if not QR_AVAILABLE:
+            raise RuntimeError("QR libraries not installed!")
+        failed = []
+        for lane, source in sources.items():
+            if isinstance(source, str) and os.path.isfile(source):
+                camera = RecordedCamera(source)
+            else:
+                camera = cv2.VideoCapture(source)
+            camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+            # Keep the driver queue short so frames are fresh after an idle sleep
+            camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            if camera.isOpened():
+                self.cameras[lane] = camera
+            else:
+                camera.release()
+                failed.append(f"{lane} ({source})")
+        if not self.cameras:
+            raise RuntimeError("Could not access camera!")
+        self.pipeline = ScanPipeline(self.cameras, decode_mode=decode_mode,
+                                     scheduler_settings=scheduler_settings,
+                                     matcher=self.face_matcher)
+        self.pipeline.start()
+        return failed
+
+    def stop_cameras(self):
+        if self.pipeline:
+            print(f"QR pipeline stats: {self.pipeline.stats()}")
+            print(f"QR debounce stats: {self.debounce.stats()}")
+            self.pipeline.stop()
+            self.pipeline = None
+        for camera in self.cameras.values():
+            try:
+                camera.release()
+            except Exception:
+                pass
+        self.cameras = {}
+
+    def poll_scans(self, timeout=0):
+        """Scanned student IDs since the last call that pass the debounce.
+
+        Returns (student_id, lane, scan_method) tuples; waits up to
+        ``timeout`` seconds for the first one.
+        """
+        scans = []
+        if not self.pipeline:
+            return scans
+        try:
+            item = self.pipeline.results.get(timeout=timeout) if timeout else \
+                self.pipeline.results.get_nowait()
+            while True:
+                kind, student_id, captured_at, lane = item
+                if self.debounce.allow(student_id):
+                    scans.append((student_id, lane, SCAN_METHODS[kind]))
+                item = self.pipeline.results.get_nowait()
+        except queue.Empty:
+            pass
+        return scans
+
+
+def run_headless(service, sources, decode_mode="multiscale", scheduler_settings=None,
+                 stats_interval=60, scan_api=None):
+    """Run the camera lanes and log scans until SIGINT/SIGTERM, without a display.
+
+    With a running scan_api.ScanApiServer and no camera sources, only API
+    scans are recorded. The API server is stopped before the service closes.
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    def on_recorded(result, error):
+        if error:
+            print(f"Failed to record scan: {str(error)}")
+            return
+        time_field = "entry_time" if result["action"] == "entry" else "exit_time"
+        print(f"{result['action'].title()}: {result['student_id']} at {result[time_field]} "
+              f"(inside: {result['summary']['currently_inside']})")
+
+    try:
+        if sources or not scan_api:
+            for lane in service.start_cameras(sources, decode_mode, scheduler_settings):
+                print(f"Warning: could not access camera for {lane}")
+        inputs = list(service.cameras) + (["scan API"] if scan_api else [])
+        print(f"Gate running headless on {', '.join(inputs)}; Ctrl+C to stop")
+        next_stats = time.time() + stats_interval
+        while not stop.is_set():
+            if not service.pipeline:
+                stop.wait(0.1)
+            for student_id, lane, scan_method in service.poll_scans(timeout=0.1):
+                if not service.lookup_student(student_id):
+                    print(f"Warning: unknown student ID {student_id} ({lane})")
+                service.submit_scan(student_id, scan_method, lane, callback=on_recorded)
+            service.run_confirmations()
+            if time.time() >= next_stats:
+                next_stats = time.time() + stats_interval
+                print(f"Today: {service.today_stats()}")
+                print(f"Hot path timings: {METRICS.summary()}")
+    finally:
+        if scan_api:
+            scan_api.stop()
+        service.close()
+
+
+if __name__ == "__main__":
+    # Headless gate for kiosks and servers; imports nothing from the Tk GUI
+    parser = argparse.ArgumentParser(description="College gate ID scanner, without a display")
+    parser.add_argument("--face", action="store_true",
+                        help="recognise faces instead of decoding QR codes")
+    parser.add_argument("--api", default=SCAN_API_ADDRESS, metavar="HOST:PORT",
+                        help="serve the HTTP/WebSocket scan API here (default: $GATE_API)")
+    args = parser.parse_args()
+    service = GateService(gate_db.DB_PATH, DB_DURABILITY, DB_COMMIT_WINDOW).open()
+    scan_api = None
+    if args.api:
+        scan_api = ScanApiServer(service, *parse_address(args.api), SCAN_API_TOKEN).start()
+    run_headless(service, dict(zip(LANE_NAMES, CAMERA_SOURCES)),
+                 SCANNER_MODES["Face" if args.face else "QR code"], QR_SCHEDULER_SETTINGS,
+                 scan_api=scan_api)
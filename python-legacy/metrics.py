@@ -0,0 +1,160 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds in ms: 10 per power of ten from 1 us to 100 s,
+# so a percentile read from the buckets is within ~26% of the true value
+BUCKET_BOUNDS = [10 ** (exp / 10) for exp in range(-30, 51)]
+
+# Percentiles reported by snapshot()
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    """Fixed-bucket histogram of durations in ms.
+
+    Recording is a bisect and a few additions under a lock, cheap enough
+    for every frame and every scan. Percentiles are read from the buckets.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        idx = bisect_left(BUCKET_BOUNDS, value)
+        with self.lock:
+            self.buckets[idx] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the ``pct``th percentile"""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = self.count * pct / 100
+            seen = 0
+            for idx, bucket in enumerate(self.buckets):
+                seen += bucket
+                if seen >= rank and bucket:
+                    bound = BUCKET_BOUNDS[idx] if idx < len(BUCKET_BOUNDS) else self.max
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self):
+        summary = {"count": self.count,
+                   "mean": round(self.total / self.count, 3) if self.count else 0.0}
+        for pct in PERCENTILES:
+            summary[f"p{pct}"] = round(self.percentile(pct), 3)
+        summary["max"] = round(self.max, 3)
+        return summary
+
+
+class Span:
+    """Times a ``with`` block into a histogram"""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(1000 * (time.perf_counter() - self.start))
+        return False
+
+
+class Metrics:
+    """Named histograms and counters for the hot path.
+
+    ``span(name)`` times a block, ``observe(name, ms)`` records a duration
+    measured elsewhere (e.g. in a decode process) and ``count(name)``
+    bumps a counter. Names are dotted by stage: camera.*, qr.*, db.*,
+    ui.*, api.*. ``snapshot()`` is what the metrics endpoint serves.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def span(self, name):
+        return Span(self.histogram(name))
+
+    def observe(self, name, value):
+        self.histogram(name).record(value)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "timings_ms": {name: histograms[name].snapshot() for name in sorted(histograms)},
+            "counters": counters,
+        }
+
+    def summary(self, names=None):
+        """One line of p50/p99 timings, e.g. for a stats label or a log line"""
+        parts = []
+        for name, histogram in sorted(self.histograms.items()):
+            if histogram.count and (names is None or name in names):
+                parts.append(f"{name} {histogram.percentile(50):.1f}/{histogram.percentile(99):.1f}")
+        return "p50/p99 ms: " + ", ".join(parts) if parts else ""
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.time()
+
+
+class SampledLog:
+    """print() for lines that can repeat every frame.
+
+    Each ``key`` gets at most one line per ``interval`` seconds; how many
+    were held back in between is appended to the next line printed.
+    """
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key, message):
+        now = time.monotonic()
+        with self.lock:
+            printed_at, suppressed = self.last.get(key, (None, 0))
+            if printed_at is not None and now - printed_at < self.interval:
+                self.last[key] = (printed_at, suppressed + 1)
+                return
+            self.last[key] = (now, 0)
+        if suppressed:
+            message = f"{message} (+{suppressed} similar in the last {self.interval:.0f}s)"
+        print(message)
+
+
+# Process-wide instances
+METRICS = Metrics()
+sampled_log = SampledLog()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import qrcode
+from PIL import Image
+
+
+def payload_key(payload):
+    """Content address of a QR payload"""
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_png(payload, path):
+    """Render the QR code for ``payload`` into ``path``; also runs in pool processes"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    # Write then rename, so a reader never sees half a file
+    part = f"{path}.{os.getpid()}.part"
+    qr.make_image(fill_color="black", back_color="white").save(part, format="PNG")
+    os.replace(part, path)
+    return path
+
+
+class QrImageCache:
+    """QR code images generated on demand and kept in two LRU tiers.
+
+    Images are keyed by the SHA-256 of their payload, so a changed student
+    ID simply maps to a new entry and a lost file is re-rendered on the
+    next request. The memory tier holds up to ``memory_items`` decoded
+    images; the disk tier keeps PNGs under ``cache_dir`` up to
+    ``disk_bytes`` in total, evicting the least recently used files (by
+    mtime, which every hit refreshes).
+    """
+
+    def __init__(self, cache_dir="qr_cache", memory_items=128, disk_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_usage = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.generated = 0
+        self.evicted = 0
+
+    def disk_path(self, payload):
+        key = payload_key(payload)
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def image(self, payload):
+        """The QR image for ``payload``, rendering it if no tier has it"""
+        key = payload_key(payload)
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return image
+        path = self.path(payload)
+        with Image.open(path) as opened:
+            image = opened.copy()
+        with self.lock:
+            self.memory[key] = image
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+        return image
+
+    def path(self, payload):
+        """Path of the cached PNG for ``payload``, rendering it if missing"""
+        path = self.disk_path(payload)
+        try:
+            os.utime(path)
+            with self.lock:
+                self.disk_hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+        render_png(payload, path)
+        with self.lock:
+            self.generated += 1
+        self.add_files([path])
+        return path
+
+    def missing(self, payloads):
+        """(payload, path) pairs not in the disk tier, e.g. to render in a pool"""
+        return [(payload, path) for payload, path in ((p, self.disk_path(p)) for p in payloads)
+                if not os.path.exists(path)]
+
+    def add_files(self, paths):
+        """Account for PNGs written into the disk tier and evict if over budget"""
+        with self.lock:
+            if self.disk_usage is None:
+                self.disk_usage = sum(size for _, size, _ in self._disk_files())
+            else:
+                self.disk_usage += sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+            if self.disk_usage > self.disk_bytes:
+                self._evict(set(paths))
+
+    def _disk_files(self):
+        """(path, size, mtime) of every PNG in the disk tier"""
+        files = []
+        if not os.path.isdir(self.cache_dir):
+            return files
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self, keep):
+        # Oldest first, down to 90% of the budget so eviction doesn't run on every add
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        self.disk_usage = sum(size for _, size, _ in files)
+        target = self.disk_bytes * 0.9
+        for path, size, _ in files:
+            if self.disk_usage <= target:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.disk_usage -= size
+            self.evicted += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_items": len(self.memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "generated": self.generated,
+                "evicted": self.evicted,
+                "disk_bytes": self.disk_usage,
+            }
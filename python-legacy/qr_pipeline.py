@@ -0,0 +1,601 @@
+import os
+import multiprocessing
+import threading
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+from PIL import Image
+from pyzbar import pyzbar
+
+from face_match import face_descriptors
+from metrics import METRICS, sampled_log
+
+
+class LatestFrameBuffer:
+    """Single-slot frame buffer where a newer frame replaces an unread one"""
+
+    def __init__(self, wakeup=None):
+        self._cond = threading.Condition()
+        self._item = None
+        # Optional event shared by several buffers so one thread can wait on all of them
+        self.wakeup = wakeup
+        self.dropped = 0
+
+    def put(self, item):
+        """Store an item, dropping the previous one if nobody took it"""
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def get(self, timeout=None):
+        """Wait for an item and take it (returns None on timeout)"""
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def get_nowait(self):
+        """Take the current item without waiting (None if empty)"""
+        with self._cond:
+            item, self._item = self._item, None
+            return item
+
+
+def _polygon(obj, scale=1.0, offset=(0, 0)):
+    """pyzbar polygon as an int32 array in full-frame coordinates"""
+    points = np.array([(p.x, p.y) for p in obj.polygon], dtype=np.float32)
+    points = points / scale + np.array(offset, dtype=np.float32)
+    return points.astype(np.int32)
+
+
+class FullFrameDecoder:
+    """Decodes the whole BGR frame at full resolution (the original behaviour)"""
+
+    kind = "qr"
+
+    def decode(self, frame):
+        start = time.perf_counter()
+        decoded = [(obj.data, _polygon(obj)) for obj in pyzbar.decode(frame)]
+        elapsed = 1000 * (time.perf_counter() - start)
+        return decoded, {"full": elapsed, "total": elapsed}
+
+
+class MultiScaleDecoder:
+    """Grayscale, downscale-first QR decoding.
+
+    Every frame is converted to grayscale once and decoded at ``scale``.
+    Only when that cheap pass finds nothing is full resolution used: first
+    on the region where a code was last seen (for ``roi_ttl`` seconds), and
+    otherwise on the whole frame every ``full_every`` frames so small or
+    distant codes are still picked up.
+    """
+
+    kind = "qr"
+
+    def __init__(self, scale=0.5, roi_margin=0.3, roi_ttl=2.0, full_every=4):
+        self.scale = scale
+        self.roi_margin = roi_margin
+        self.roi_ttl = roi_ttl
+        self.full_every = full_every
+        self.roi = None
+        self.roi_time = 0
+        self.misses = 0
+
+    def decode(self, frame):
+        timings = {}
+        start = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        mark = time.perf_counter()
+        timings["gray"] = 1000 * (mark - start)
+
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        decoded = [(obj.data, _polygon(obj, self.scale)) for obj in pyzbar.decode(small)]
+        now = time.perf_counter()
+        timings["small"] = 1000 * (now - mark)
+        mark = now
+
+        if not decoded and self.roi is not None and time.time() - self.roi_time < self.roi_ttl:
+            x0, y0, x1, y1 = self.roi
+            decoded = [(obj.data, _polygon(obj, offset=(x0, y0)))
+                       for obj in pyzbar.decode(gray[y0:y1, x0:x1])]
+            now = time.perf_counter()
+            timings["roi"] = 1000 * (now - mark)
+            mark = now
+
+        if decoded:
+            self.misses = 0
+            self.remember_roi(decoded, gray.shape)
+        else:
+            self.misses += 1
+            if self.misses % self.full_every == 0:
+                decoded = [(obj.data, _polygon(obj)) for obj in pyzbar.decode(gray)]
+                now = time.perf_counter()
+                timings["full"] = 1000 * (now - mark)
+                if decoded:
+                    self.misses = 0
+                    self.remember_roi(decoded, gray.shape)
+
+        timings["total"] = 1000 * (time.perf_counter() - start)
+        return decoded, timings
+
+    def remember_roi(self, decoded, shape):
+        """Store a padded bounding box around the decoded codes"""
+        points = np.concatenate([polygon for _, polygon in decoded])
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        pad_x = int((x1 - x0) * self.roi_margin) + 16
+        pad_y = int((y1 - y0) * self.roi_margin) + 16
+        height, width = shape[:2]
+        self.roi = (max(0, x0 - pad_x), max(0, y0 - pad_y),
+                    min(width, x1 + pad_x), min(height, y1 + pad_y))
+        self.roi_time = time.time()
+
+
+class FaceDecoder:
+    """Finds faces and returns their 128-d descriptors instead of QR payloads.
+
+    Faces are located on a frame downscaled by ``scale`` and described at
+    full resolution (needs face_recognition). Matching the descriptors to
+    students happens in the parent process, where the enrolled matrix lives.
+    """
+
+    kind = "face"
+
+    def __init__(self, scale=0.25, model="hog", max_faces=4):
+        self.scale = scale
+        self.model = model
+        self.max_faces = max_faces
+
+    def decode(self, frame):
+        start = time.perf_counter()
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        decoded = []
+        for descriptor, (top, right, bottom, left) in face_descriptors(rgb, self.scale, self.model,
+                                                                       self.max_faces):
+            box = np.array([(left, top), (right, top), (right, bottom), (left, bottom)], dtype=np.int32)
+            decoded.append((descriptor, box))
+        elapsed = 1000 * (time.perf_counter() - start)
+        return decoded, {"face": elapsed, "total": elapsed}
+
+
+DECODE_MODES = {
+    "full": FullFrameDecoder,
+    "multiscale": MultiScaleDecoder,
+    "face": FaceDecoder,
+}
+
+
+def _decode_frame(decoder, frame):
+    """Runs in a pool process; the decoder travels along so its ROI state is kept"""
+    decoded_objects, timings = decoder.decode(frame)
+    return decoded_objects, timings, decoder
+
+
+class AdaptiveRateScheduler:
+    """Picks capture, decode and preview rates from a cheap frame difference.
+
+    Each captured frame is shrunk to a tiny grayscale thumbnail and compared
+    with the previous one. When the mean absolute difference goes over
+    ``motion_threshold`` (or a code was just decoded) the scanner runs at the
+    active rates for ``hold_seconds``; otherwise it falls back to the idle
+    rates and the capture thread sleeps between reads.
+    """
+
+    def __init__(self, active_decode_fps=15, idle_decode_fps=2,
+                 active_preview_fps=25, idle_preview_fps=4,
+                 motion_threshold=4.0, hold_seconds=3.0, thumb_size=(64, 36)):
+        self.active_decode_fps = active_decode_fps
+        self.idle_decode_fps = idle_decode_fps
+        self.active_preview_fps = active_preview_fps
+        self.idle_preview_fps = idle_preview_fps
+        self.motion_threshold = motion_threshold
+        self.hold_seconds = hold_seconds
+        self.thumb_size = thumb_size
+        self.previous_thumb = None
+        self.active_until = 0
+        self.last_motion = 0.0
+        self.wakeups = 0
+
+    def update(self, frame, now):
+        """Measure motion against the previous frame and refresh the state"""
+        thumb = cv2.cvtColor(cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA),
+                             cv2.COLOR_BGR2GRAY).astype(np.int16)
+        if self.previous_thumb is not None:
+            self.last_motion = float(np.abs(thumb - self.previous_thumb).mean())
+            if self.last_motion > self.motion_threshold:
+                self.keep_active(now)
+        self.previous_thumb = thumb
+
+    def keep_active(self, now=None):
+        now = time.time() if now is None else now
+        if now >= self.active_until:
+            self.wakeups += 1
+        self.active_until = now + self.hold_seconds
+
+    def is_active(self, now=None):
+        return (time.time() if now is None else now) < self.active_until
+
+    def decode_interval(self, now=None):
+        fps = self.active_decode_fps if self.is_active(now) else self.idle_decode_fps
+        return 1.0 / fps
+
+    def preview_interval(self, now=None):
+        fps = self.active_preview_fps if self.is_active(now) else self.idle_preview_fps
+        return 1.0 / fps
+
+    def stats(self):
+        return {
+            "active": self.is_active(),
+            "motion": self.last_motion,
+            "wakeups": self.wakeups,
+        }
+
+
+class RecordedCamera:
+    """A video file that reads like a camera, for replaying recorded gate traffic.
+
+    Frames are handed out at the file's frame rate when ``realtime`` is set,
+    otherwise as fast as they are asked for. At the end of the file
+    ``finished`` is set, unless ``loop`` starts it over.
+    """
+
+    def __init__(self, path, realtime=True, loop=False):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = False
+        self.started_at = None
+        self.frames_played = 0
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def set(self, prop, value):
+        # Resolution and buffering are fixed by the recording
+        return False
+
+    def read(self):
+        if self.finished:
+            return False, None
+        ret, frame = self.capture.read()
+        if not ret and self.loop and self.frames_played:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.started_at = None
+            self.frames_played = 0
+            ret, frame = self.capture.read()
+        if not ret:
+            self.finished = True
+            return False, None
+        if self.realtime:
+            now = time.perf_counter()
+            if self.started_at is None:
+                self.started_at = now
+            wait = self.started_at + self.frames_played / self.fps - now
+            if wait > 0:
+                time.sleep(wait)
+        self.frames_played += 1
+        return True, frame
+
+    def release(self):
+        self.capture.release()
+
+
+class CaptureThread(threading.Thread):
+    """Reads frames from the camera and publishes the newest one"""
+
+    def __init__(self, camera, frames, previews, preview_size=(900, 700), scheduler=None,
+                 name="qr-capture"):
+        super().__init__(name=name, daemon=True)
+        self.camera = camera
+        self.frames = frames
+        self.previews = previews
+        self.preview_size = preview_size
+        self.scheduler = scheduler or AdaptiveRateScheduler()
+        self.stop_event = threading.Event()
+        # (timestamp, polygons) of the last decode, drawn on the preview
+        self.overlay = (0, [])
+        self.frames_read = 0
+        self.read_failures = 0
+
+    def run(self):
+        next_decode = next_preview = 0
+        read_span = METRICS.span("camera.read")
+        preview_span = METRICS.span("camera.preview")
+        while not self.stop_event.is_set():
+            with read_span:
+                ret, frame = self.camera.read()
+            if not ret:
+                if getattr(self.camera, "finished", False):
+                    # End of a recorded video
+                    break
+                self.read_failures += 1
+                sampled_log(f"read-{self.name}", f"Failed to read frame from camera ({self.name}).")
+                time.sleep(0.05)
+                continue
+            self.frames_read += 1
+            now = time.time()
+            self.scheduler.update(frame, now)
+            if self.scheduler.is_active(now):
+                # Do not wait out an idle interval once someone is in view
+                next_decode = min(next_decode, now + self.scheduler.decode_interval(now))
+                next_preview = min(next_preview, now + self.scheduler.preview_interval(now))
+            if now >= next_decode:
+                self.frames.put((now, frame))
+                next_decode = now + self.scheduler.decode_interval(now)
+            if now >= next_preview:
+                try:
+                    with preview_span:
+                        self.previews.put(self.render_preview(frame))
+                except Exception as e:
+                    sampled_log(f"preview-{self.name}", f"Error displaying frame: {str(e)}")
+                next_preview = now + self.scheduler.preview_interval(now)
+            if not self.scheduler.is_active(now):
+                # Idle: only look at the scene as often as the idle rates need
+                wait = min(next_decode, next_preview) - time.time()
+                if wait > 0:
+                    self.stop_event.wait(wait)
+
+    def render_preview(self, frame):
+        """Convert a BGR frame to a resized PIL image with QR outlines drawn"""
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        overlay_time, polygons = self.overlay
+        if polygons and time.time() - overlay_time < 0.5:
+            for points in polygons:
+                if len(points) > 4:
+                    points = cv2.convexHull(points)
+                cv2.polylines(image, [points], True, (0, 255, 0), 3)
+        image = cv2.resize(image, self.preview_size)
+        return Image.fromarray(image)
+
+
+class Lane:
+    """One camera at the gate: its capture thread, buffers and decode state"""
+
+    def __init__(self, lane_id, camera, wakeup, preview_size=(900, 700),
+                 decode_mode="multiscale", scheduler_settings=None):
+        self.lane_id = lane_id
+        self.camera = camera
+        self.frames = LatestFrameBuffer(wakeup)
+        self.previews = LatestFrameBuffer()
+        self.scheduler = AdaptiveRateScheduler(**(scheduler_settings or {}))
+        self.capture = CaptureThread(camera, self.frames, self.previews, preview_size,
+                                     self.scheduler, name=f"qr-capture-{lane_id}")
+        self.decode_mode = decode_mode
+        self.decoder = DECODE_MODES[decode_mode]()
+        self.in_flight = False
+        self.started_at = None
+        self.frames_decoded = 0
+        self.codes_found = 0
+        # Capture-to-result latency and per-frame decode timing breakdown (ms)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_timings = {}
+        self.stage_totals = {}
+        self.stage_counts = {}
+
+    def record(self, timings, latency_ms):
+        self.frames_decoded += 1
+        self.latency_total += latency_ms
+        self.latency_max = max(self.latency_max, latency_ms)
+        self.last_timings = timings
+        for stage, ms in timings.items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + ms
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+    def stats(self):
+        """Throughput, latency and decode timing breakdown for this lane.
+
+        ``stage_ms`` is the average time of each decode stage over the frames
+        that ran it and ``stage_runs`` how many frames that was, so the cost
+        of the fallback passes can be told apart from the cheap pass.
+        """
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0
+        decoded = self.frames_decoded
+        return {
+            "lane": self.lane_id,
+            "decode_mode": self.decode_mode,
+            "frames_read": self.capture.frames_read,
+            "read_failures": self.capture.read_failures,
+            "frames_dropped": self.frames.dropped,
+            "frames_decoded": decoded,
+            "codes_found": self.codes_found,
+            "decode_fps": decoded / elapsed if elapsed else 0.0,
+            "avg_decode_ms": self.stage_totals.get("total", 0.0) / decoded if decoded else 0.0,
+            "avg_latency_ms": self.latency_total / decoded if decoded else 0.0,
+            "max_latency_ms": self.latency_max,
+            "stage_ms": {stage: self.stage_totals[stage] / self.stage_counts[stage]
+                         for stage in self.stage_totals},
+            "stage_runs": dict(self.stage_counts),
+            "scheduler": self.scheduler.stats(),
+        }
+
+
+class DecodeDispatcher(threading.Thread):
+    """Hands the newest frame of every lane to one shared process pool.
+
+    Each lane has at most one frame in flight, so a slow decode on one lane
+    never queues stale frames and the lanes share the cores fairly.
+    """
+
+    def __init__(self, lanes, results, wakeup, workers=None, matcher=None):
+        super().__init__(name="qr-dispatch", daemon=True)
+        self.lanes = lanes
+        self.results = results
+        self.wakeup = wakeup
+        # face_match.FaceMatcher for lanes in face mode
+        self.matcher = matcher
+        # The pool starts after the capture threads, so a forked decoder could
+        # inherit one of their locks mid-use; spawned ones start clean
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.wakeup.wait(0.2)
+            self.wakeup.clear()
+            for lane in self.lanes:
+                if lane.in_flight:
+                    continue
+                item = lane.frames.get_nowait()
+                if item is None:
+                    continue
+                captured_at, frame = item
+                lane.in_flight = True
+                try:
+                    future = self.executor.submit(_decode_frame, lane.decoder, frame)
+                except RuntimeError:
+                    # Pool already shut down
+                    return
+                future.add_done_callback(
+                    lambda f, lane=lane, captured_at=captured_at: self.on_decoded(lane, captured_at, f))
+
+    def on_decoded(self, lane, captured_at, future):
+        """Record the result of one decode (runs on the pool's result thread)"""
+        try:
+            if future.cancelled():
+                return
+            decoded_objects, timings, lane.decoder = future.result()
+            latency_ms = 1000 * (time.time() - captured_at)
+            lane.record(timings, latency_ms)
+            METRICS.observe("qr.capture_to_result", latency_ms)
+            for stage, ms in timings.items():
+                METRICS.observe(f"qr.decode.{stage}", ms)
+            polygons = []
+            kind = lane.decoder.kind
+            for data, polygon in decoded_objects:
+                try:
+                    polygons.append(polygon)
+                    lane.scheduler.keep_active()
+                    if kind == "face":
+                        with METRICS.span("face.match"):
+                            match = self.matcher.match(data) if self.matcher is not None else None
+                        if match is None:
+                            continue
+                        student_id = match[0]
+                    else:
+                        student_id = data.decode('utf-8')
+                    lane.codes_found += 1
+                    self.results.put((kind, student_id, captured_at, lane.lane_id))
+                except Exception as e:
+                    sampled_log("qr-data", f"Error processing QR code: {str(e)}")
+                    continue
+            lane.capture.overlay = (time.time(), polygons)
+        except Exception as e:
+            sampled_log(f"decode-{lane.lane_id}", f"Error decoding frame on {lane.lane_id}: {str(e)}")
+        finally:
+            lane.in_flight = False
+            self.wakeup.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        self.join(timeout=2)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DebounceTable:
+    """Per-ID debounce for decoded codes.
+
+    An ID is let through once and then suppressed for ``window`` seconds.
+    Every repeat sighting restarts its window, so a code held in front of
+    the camera is only processed once, while different IDs pass straight
+    through. Entries are kept in expiry order so purging is O(expired).
+    """
+
+    def __init__(self, window=3.0, max_entries=10000):
+        self.window = window
+        self.max_entries = max_entries
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.suppressed = 0
+
+    def allow(self, key, now=None):
+        """Return True if ``key`` should be processed now"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._purge(now)
+            seen = key in self._expiry
+            if seen:
+                self.suppressed += 1
+                self._expiry.move_to_end(key)
+            else:
+                self.hits += 1
+            self._expiry[key] = now + self.window
+            if len(self._expiry) > self.max_entries:
+                self._expiry.popitem(last=False)
+            return not seen
+
+    def forget(self, key):
+        with self._lock:
+            self._expiry.pop(key, None)
+
+    def _purge(self, now):
+        while self._expiry:
+            key, expiry = next(iter(self._expiry.items()))
+            if expiry > now:
+                break
+            self._expiry.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            self._purge(time.monotonic())
+            return {
+                "hits": self.hits,
+                "suppressed": self.suppressed,
+                "tracked": len(self._expiry),
+            }
+
+
+class ScanPipeline:
+    """Capture threads for every gate lane feeding one shared decode pool.
+
+    ``cameras`` maps a lane name to an opened camera. Decoded IDs are posted
+    to ``results`` as (kind, student_id, captured_at, lane) tuples, kind
+    being "qr", or "face" for faces ``matcher`` recognised in face mode, and the
+    newest preview image of each lane is kept in ``lanes[name].previews``;
+    the Tk loop only has to drain them. ``scheduler_settings`` are passed to
+    AdaptiveRateScheduler to tune the idle and active rates of every lane.
+    """
+
+    def __init__(self, cameras, preview_size=(900, 700), decode_mode="multiscale",
+                 scheduler_settings=None, workers=None, matcher=None):
+        self.results = queue.Queue()
+        self.wakeup = threading.Event()
+        self.lanes = {}
+        for lane_id, camera in cameras.items():
+            self.lanes[lane_id] = Lane(lane_id, camera, self.wakeup, preview_size,
+                                       decode_mode, scheduler_settings)
+        self.dispatcher = DecodeDispatcher(list(self.lanes.values()), self.results,
+                                           self.wakeup, workers, matcher)
+
+    def start(self):
+        for lane in self.lanes.values():
+            lane.started_at = time.perf_counter()
+            lane.capture.start()
+        self.dispatcher.start()
+
+    def stop(self):
+        """Stop all threads and the pool; the caller releases the cameras afterwards"""
+        for lane in self.lanes.values():
+            lane.capture.stop_event.set()
+        for lane in self.lanes.values():
+            lane.capture.join(timeout=2)
+        self.dispatcher.stop()
+
+    def stats(self):
+        """Per-lane throughput and latency"""
+        return {lane_id: lane.stats() for lane_id, lane in self.lanes.items()}
@@ -0,0 +1,432 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import struct
+import threading
+from urllib.parse import urlsplit
+
+from metrics import METRICS
+
+# Largest request body or WebSocket message accepted
+MAX_BODY_BYTES = 4 * 1024 * 1024
+# Scans accepted in one batch
+MAX_BATCH_SCANS = 10000
+# Student IDs are short; anything longer is a client bug
+MAX_STUDENT_ID_LENGTH = 64
+# Pushes queued for one WebSocket subscriber before it is dropped as too slow
+SUBSCRIBER_QUEUE_SIZE = 256
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_scans(payload):
+    """Scan events from a request body: one object, {"scans": [...]} or a list.
+
+    Returns ([(student_id, scan_method, lane)], batched); raises ApiError.
+    """
+    batched = True
+    if isinstance(payload, dict) and "scans" in payload:
+        events = payload["scans"]
+    elif isinstance(payload, list):
+        events = payload
+    else:
+        events, batched = [payload], False
+    if not isinstance(events, list):
+        raise ApiError(400, "'scans' must be a list")
+    if len(events) > MAX_BATCH_SCANS:
+        raise ApiError(413, f"At most {MAX_BATCH_SCANS} scans per batch")
+    scans = []
+    for event in events:
+        if not isinstance(event, dict):
+            raise ApiError(400, "Each scan must be an object with a student_id")
+        student_id = event.get("student_id")
+        if isinstance(student_id, int) and not isinstance(student_id, bool):
+            student_id = str(student_id)
+        if not isinstance(student_id, str) or not student_id.strip():
+            raise ApiError(400, "Each scan needs a student_id")
+        student_id = student_id.strip()
+        if len(student_id) > MAX_STUDENT_ID_LENGTH or any(ch.isspace() for ch in student_id):
+            raise ApiError(400, f"Invalid student_id '{student_id[:MAX_STUDENT_ID_LENGTH]}'")
+        scan_method = event.get("scan_method") or "API"
+        lane = event.get("lane")
+        if not isinstance(scan_method, str) or (lane is not None and not isinstance(lane, str)):
+            raise ApiError(400, "scan_method and lane must be strings")
+        scans.append((student_id, scan_method, lane))
+    return scans, batched
+
+
+def parse_address(address):
+    """"host:port" or just a port -> (host, port); the host defaults to all interfaces"""
+    host, _, port = address.rpartition(":")
+    try:
+        return host or "0.0.0.0", int(port)
+    except ValueError:
+        raise ValueError(f"Invalid scan API address '{address}', expected host:port")
+
+
+def job_result(job):
+    """JSON-ready outcome of a committed record_scan job"""
+    if job.error:
+        return {"student_id": job.args[2], "error": str(job.error)}
+    return job.result
+
+
+class ScanApiServer(threading.Thread):
+    """HTTP/WebSocket endpoint that lets handheld scanners and turnstiles record scans.
+
+    Runs an asyncio loop on its own thread. Scans are submitted to the
+    service's DB writer exactly like the GUI's, so the entry/exit decision
+    is the same ``gate_db.record_scan``; a batch is submitted in one go and
+    lands in one group commit. Replies are sent once the scans are
+    committed. Every committed scan, from any client, is pushed to the
+    WebSocket subscribers as one message per commit.
+
+    ``POST /scans``  one scan object, ``{"scans": [...]}`` or a list of them
+    ``GET /stats``   today's counters as of the last committed scan
+    ``GET /metrics`` hot-path timing histograms and counters (metrics.METRICS)
+    ``GET /live``    WebSocket: committed scans are pushed as
+                     ``{"type": "scans", "scans": [...]}``; scan messages
+                     sent on it are recorded and answered with
+                     ``{"type": "results", "results": [...]}``
+
+    With a ``token``, requests need ``Authorization: Bearer <token>``.
+    """
+
+    def __init__(self, service, host="127.0.0.1", port=8765, token=None):
+        super().__init__(name="scan-api", daemon=True)
+        self.service = service
+        self.host = host
+        self.port = port
+        self.token = token
+        self.loop = None
+        self.stopping = None
+        self.ready = threading.Event()
+        self.error = None
+        # record_scan job -> future of the request waiting for it; loop thread only
+        self.pending = {}
+        # WebSocket subscriber push queue -> its stream writer
+        self.subscribers = {}
+        # Stream writers of every open connection, closed when the server stops
+        self.connections = set()
+        # Built on the owner's thread; afterwards kept current from committed scans
+        self.last_summary = service.today_stats()
+        self.requests = 0
+        self.scans = 0
+        self.pushes = 0
+        self.dropped_subscribers = 0
+
+    def start(self):
+        """Start serving; raises if the port cannot be bound"""
+        super().start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        self.service.add_scan_listener(self.on_commit)
+        return self
+
+    def stop(self):
+        if self.loop and self.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.join(timeout=5)
+        print(f"Scan API stats: {self.stats()}")
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                            limit=MAX_BODY_BYTES)
+        self.ready.set()
+        print(f"Scan API listening on http://{self.host}:{self.port}")
+        async with server:
+            await self.stopping.wait()
+        # Hang up on every client, keep-alive and WebSocket alike, and give
+        # their handlers a moment to finish
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.sleep(0.05)
+
+    # --- Commits (writer thread) ---
+
+    def on_commit(self, jobs):
+        try:
+            self.loop.call_soon_threadsafe(self.committed, jobs)
+        except RuntimeError:
+            # Loop already closed by stop()
+            pass
+
+    def committed(self, jobs):
+        recorded = []
+        for job in jobs:
+            future = self.pending.pop(job, None)
+            if future is not None and not future.done():
+                future.set_result(job_result(job))
+            if not job.error:
+                recorded.append(job.result)
+        if not recorded:
+            return
+        self.last_summary = recorded[-1]["summary"]
+        if self.subscribers:
+            message = json.dumps({"type": "scans", "scans": recorded})
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # A subscriber that stopped reading must not hold up the others
+                    self.subscribers.pop(queue).close()
+                    self.dropped_subscribers += 1
+            self.pushes += 1
+
+    async def record(self, scans):
+        """Submit scans to the writer and wait until they are committed"""
+        futures = []
+        for student_id, scan_method, lane in scans:
+            job = self.service.submit_scan(student_id, scan_method, lane)
+            # Registered before the loop runs again, so committed() always finds it
+            future = self.loop.create_future()
+            self.pending[job] = future
+            futures.append(future)
+        self.scans += len(scans)
+        return await asyncio.gather(*futures)
+
+    # --- HTTP ---
+
+    async def handle_client(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                self.requests += 1
+                path = urlsplit(target).path
+                if path == "/live" and headers.get("upgrade", "").lower() == "websocket":
+                    if self.authorized(headers):
+                        await self.websocket(reader, writer, headers)
+                    else:
+                        await send_json(writer, 401, {"error": "Missing or wrong token"})
+                    break
+                try:
+                    status, reply = await self.route(method, path, headers, body)
+                except ApiError as e:
+                    status, reply = e.status, {"error": str(e)}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await send_json(writer, status, reply, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except asyncio.CancelledError:
+            # Still waiting on a client when the loop shuts down; nothing left to answer
+            pass
+        except ApiError as e:
+            try:
+                await send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+            except ConnectionError:
+                pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    def authorized(self, headers):
+        if not self.token:
+            return True
+        return hmac.compare_digest(headers.get("authorization", ""), f"Bearer {self.token}")
+
+    async def route(self, method, path, headers, body):
+        if path not in ("/scans", "/stats", "/metrics"):
+            raise ApiError(404, f"No such endpoint: {path}")
+        if not self.authorized(headers):
+            raise ApiError(401, "Missing or wrong token")
+        if path in ("/stats", "/metrics"):
+            if method != "GET":
+                raise ApiError(405, "Use GET")
+            if path == "/metrics":
+                return 200, {**METRICS.snapshot(), "student_cache": self.service.student_cache.stats()}
+            return 200, {"today": self.last_summary}
+        if method != "POST":
+            raise ApiError(405, "Use POST")
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise ApiError(400, "Body must be JSON")
+        scans, batched = parse_scans(payload)
+        with METRICS.span("api.scans"):
+            results = await self.record(scans)
+        if batched:
+            return 200, {"results": results,
+                         "errors": sum(1 for result in results if "error" in result)}
+        return 200, results[0]
+
+    # --- WebSocket ---
+
+    async def websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        await writer.drain()
+
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers[queue] = writer
+        sender = asyncio.ensure_future(self.push(queue, writer))
+        frames = FrameReader(reader)
+        try:
+            while not sender.done():
+                opcode, data = await frames.read()
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    writer.write(frame(0xA, data))
+                elif opcode in (0x1, 0x2):
+                    try:
+                        scans, _ = parse_scans(json.loads(data))
+                        reply = {"type": "results", "results": await self.record(scans)}
+                    except ApiError as e:
+                        reply = {"type": "error", "error": str(e)}
+                    except ValueError:
+                        reply = {"type": "error", "error": "Message must be JSON"}
+                    writer.write(frame(0x1, json.dumps(reply).encode()))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ApiError):
+            pass
+        finally:
+            self.subscribers.pop(queue, None)
+            sender.cancel()
+            try:
+                writer.write(frame(0x8, b""))
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def push(self, queue, writer):
+        while True:
+            message = await queue.get()
+            writer.write(frame(0x1, message.encode()))
+            await writer.drain()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "scans": self.scans,
+            "pushes": self.pushes,
+            "subscribers": len(self.subscribers),
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+async def read_request(reader):
+    """(method, target, {lowercased header: value}, body) or None once the client is done"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise ApiError(400, "Incomplete request")
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise ApiError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise ApiError(400, "Bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+async def send_json(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    writer.write((f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                  "Content-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+    await writer.drain()
+
+
+class FrameReader:
+    """Reads the WebSocket messages a client sends on one connection.
+
+    Control frames (ping, close) may arrive between the fragments of a
+    message. They are returned as soon as they arrive, and the fragments
+    received so far are kept for the next ``read()``.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.message = b""
+        self.opcode = None
+
+    async def read(self):
+        """(opcode, payload) of the next control frame or complete message"""
+        reader = self.reader
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            if len(self.message) + length > MAX_BODY_BYTES:
+                raise ApiError(413, "Message too large")
+            # Client frames are always masked
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            data = await reader.readexactly(length)
+            if mask and length:
+                repeated = (mask * (length // 4 + 1))[:length]
+                data = (int.from_bytes(data, "big") ^ int.from_bytes(repeated, "big")).to_bytes(length, "big")
+            if opcode >= 0x8:
+                return opcode, data
+            if opcode:
+                self.opcode = opcode
+            self.message += data
+            if first & 0x80:
+                message, self.message = self.message, b""
+                return self.opcode, message
+
+
+def frame(opcode, data):
+    """An unmasked, unfragmented WebSocket frame from the server"""
+    length = len(data)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + data
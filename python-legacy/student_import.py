@@ -0,0 +1,206 @@
+import csv
+import importlib.util
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import gate_db
+
+# Optional: QR images and .xlsx rosters
+try:
+    from qr_cache import render_png
+    QRCODE_AVAILABLE = True
+except Exception:
+    QRCODE_AVAILABLE = False
+
+# openpyxl is slow to import, so it is only loaded to read an .xlsx roster
+XLSX_AVAILABLE = importlib.util.find_spec("openpyxl") is not None
+
+# Roster header (lowercased, spaces/underscores ignored) -> student field
+ROSTER_COLUMNS = {
+    "id": "id", "studentid": "id", "rollno": "id", "rollnumber": "id",
+    "name": "name", "fullname": "name", "studentname": "name",
+    "dept": "dept", "department": "dept",
+    "year": "year",
+    "phone": "phone", "mobile": "phone", "phonenumber": "phone",
+    "email": "email", "emailaddress": "email",
+}
+
+STUDENT_FIELDS = ["id", "name", "dept", "year", "phone", "email"]
+
+
+def _cell_text(value):
+    """Roster cell as text; spreadsheet numbers like 2.0 become "2" """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def read_roster(path):
+    """Yield (line number, {field: text}) for each data row of a CSV or XLSX roster.
+
+    Only the fields the roster has a column for are present, so a roster
+    without e.g. a phone column leaves existing phone numbers alone.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        if not XLSX_AVAILABLE:
+            raise ValueError("Reading .xlsx rosters needs openpyxl installed")
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from _roster_rows(workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as csvfile:
+            yield from _roster_rows(csv.reader(csvfile))
+
+
+def _roster_rows(rows):
+    rows = iter(rows)
+    header = next(rows, None)
+    if not header:
+        return
+    fields = [ROSTER_COLUMNS.get(_cell_text(name).lower().replace(" ", "").replace("_", ""))
+              for name in header]
+    if "id" not in fields or "name" not in fields:
+        raise ValueError("Roster needs a student ID column and a name column")
+    for line, row in enumerate(rows, start=2):
+        student = {field: "" for field in fields if field}
+        for field, value in zip(fields, row):
+            if field:
+                student[field] = _cell_text(value)
+        if any(student.values()):
+            yield line, student
+
+
+def validate(rows):
+    """Split roster rows into (valid students, [(line, problem)])"""
+    students, problems, seen = [], [], {}
+    for line, student in rows:
+        if not student["id"] or not student["name"]:
+            problems.append((line, "student ID and name are required"))
+        elif any(ch.isspace() for ch in student["id"]):
+            problems.append((line, f"student ID '{student['id']}' contains spaces"))
+        elif student["id"] in seen:
+            problems.append((line, f"duplicate student ID '{student['id']}' (first on line {seen[student['id']]})"))
+        elif student.get("email") and "@" not in student["email"]:
+            problems.append((line, f"invalid email '{student['email']}'"))
+        else:
+            seen[student["id"]] = line
+            students.append(student)
+    return students, problems
+
+
+class StudentImport(threading.Thread):
+    """Imports a roster file on a worker thread.
+
+    Rows are validated, compared against the students table and only new
+    or changed students are written: one upsert_students job on the DB
+    writer, so the whole roster lands in a single transaction. Given a
+    qr_cache.QrImageCache, the QR images of the new students are rendered
+    into its disk tier in a process pool, ready for printing ID cards.
+    Progress (``rows_done`` of
+    ``rows_total``), ``cancel()`` and ``error`` work like exports.QueryExport;
+    ``stats`` has the counts and rows/sec once finished.
+    """
+
+    def __init__(self, path, db_writer, qr_cache=None, db_path=gate_db.DB_PATH, workers=None):
+        super().__init__(name="student-import", daemon=True)
+        self.path = path
+        self.db_writer = db_writer
+        self.qr_cache = qr_cache
+        self.db_path = db_path
+        self.workers = workers
+        self.rows_done = 0
+        self.rows_total = None
+        self.error = None
+        self.problems = []
+        self.stats = {}
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self):
+        """Fraction done between 0 and 1, or None while reading"""
+        if self.rows_total is None:
+            return None
+        if not self.rows_total:
+            return 1.0
+        return min(1.0, self.rows_done / self.rows_total)
+
+    def run(self):
+        try:
+            self.import_roster()
+        except Exception as e:
+            self.error = e
+
+    def import_roster(self):
+        started = time.perf_counter()
+        students, self.problems = validate(read_roster(self.path))
+
+        # Current values of every student, to skip rows the roster doesn't change
+        conn = gate_db.connect(self.db_path)
+        try:
+            existing = {row[0]: dict(zip(STUDENT_FIELDS, (value or "" for value in row)))
+                        for row in conn.execute(gate_db.STUDENT_FIELDS_SQL)}
+        finally:
+            conn.close()
+        changed = []
+        for student in students:
+            current = existing.get(student["id"])
+            if current is None:
+                changed.append({**dict.fromkeys(STUDENT_FIELDS, ""), **student})
+            elif any(current[field] != value for field, value in student.items()):
+                changed.append({**current, **student})
+        self.rows_total = len(changed)
+
+        # QR images for IDs the cache has not rendered yet; the payload is the ID
+        missing = []
+        if self.qr_cache is not None and QRCODE_AVAILABLE:
+            missing = self.qr_cache.missing(student["id"] for student in changed)
+            self.make_qr_codes(missing)
+        if self.cancelled.is_set():
+            return
+
+        if changed:
+            self.db_writer.call(gate_db.upsert_students, changed)
+        self.rows_done = len(changed)
+        rows = len(students) + len(self.problems)
+        inserted = sum(1 for student in changed if student["id"] not in existing)
+        seconds = time.perf_counter() - started
+        self.stats = {
+            "rows": rows,
+            "invalid": len(self.problems),
+            "unchanged": len(students) - len(changed),
+            "inserted": inserted,
+            "updated": len(changed) - inserted,
+            "qr_generated": len(missing),
+            "seconds": round(seconds, 2),
+            "rows_per_sec": round(rows / seconds, 1) if seconds else 0.0,
+        }
+        print(f"Student import stats: {self.stats}")
+
+    def make_qr_codes(self, missing):
+        if not missing:
+            return
+        # render_png needs nothing but qr_cache, so fresh interpreters are cheap,
+        # and an import started from the GUI does not fork a threaded process
+        with ProcessPoolExecutor(max_workers=self.workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(render_png, student_id, path) for student_id, path in missing]
+            written = []
+            for future in as_completed(futures):
+                written.append(future.result())
+                self.rows_done += 1
+                if self.cancelled.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        self.qr_cache.add_files(written)
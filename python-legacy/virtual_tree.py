@@ -0,0 +1,160 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualTreeview(tk.Frame):
+    """ttk.Treeview that only materializes the rows in view.
+
+    Rows come from a gate_db.KeysetQuery. The view keeps a window of rows
+    around the visible ones (``margin`` rows on either side) in memory and
+    only the visible rows exist as Treeview items. Scrolling past the
+    window fetches the next page with keyset pagination; dragging the
+    scrollbar far away jumps with a single OFFSET query.
+
+    ``format_row(row)`` turns a query row (without the key columns) into
+    an (iid, values) pair for the tree. The underlying Treeview is
+    available as ``tree`` for headings, selection and bindings.
+    """
+
+    def __init__(self, parent, conn, query, columns, format_row, params=(),
+                 height=15, margin=None, **frame_options):
+        super().__init__(parent, **frame_options)
+        self.conn = conn
+        self.query = query
+        self.params = tuple(params)
+        self.format_row = format_row
+        self.visible = height
+        self.margin = margin or 2 * height
+
+        self.scrollbar = tk.Scrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=height)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+        # Cached window: [(key, iid, values)] for rows window_start..window_start + len(rows)
+        self.rows = []
+        self.window_start = 0
+        self.offset = 0
+        self.total = 0
+
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.offset - 3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.offset + 3))
+        self.tree.bind("<Configure>", self.on_resize)
+
+    def set_query(self, query, params=()):
+        """Show a different query (e.g. a search filter) from the top"""
+        self.query = query
+        self.params = tuple(params)
+        self.offset = 0
+        self.reload()
+
+    def reload(self):
+        """Re-read the row count and the rows around the current position"""
+        self.total = self.query.count(self.conn, self.params)
+        self.rows = []
+        self.scroll_to(self.offset)
+
+    def scroll_to(self, offset):
+        self.offset = max(0, min(offset, self.total - self.visible))
+        self.ensure_window()
+        self.render()
+
+    def ensure_window(self):
+        """Make sure the cached window covers the visible rows"""
+        end = min(self.offset + self.visible, self.total)
+        window_end = self.window_start + len(self.rows)
+        if self.rows and self.window_start <= self.offset and end <= window_end:
+            return
+        key_count = len(self.query.key_columns)
+        if self.rows and self.window_start <= self.offset <= window_end + self.margin:
+            # Scrolled near or past the end of the window: continue after its last key
+            rows = self.query.page_after(self.conn, self.params, self.rows[-1][0],
+                                         end - window_end + self.margin)
+            self.rows.extend(self.wrap(rows, key_count))
+        elif self.rows and self.offset < self.window_start <= end + self.margin:
+            rows = self.query.page_before(self.conn, self.params, self.rows[0][0],
+                                          self.window_start - self.offset + self.margin)
+            self.rows[:0] = self.wrap(rows, key_count)
+            self.window_start -= len(rows)
+        else:
+            start = max(0, self.offset - self.margin)
+            rows = self.query.page_at(self.conn, self.params, start,
+                                      self.offset - start + self.visible + self.margin)
+            self.rows = self.wrap(rows, key_count)
+            self.window_start = start
+        self.trim_window()
+
+    def wrap(self, rows, key_count):
+        wrapped = []
+        for row in rows:
+            iid, values = self.format_row(row[key_count:])
+            wrapped.append((row[:key_count], iid, values))
+        return wrapped
+
+    def trim_window(self):
+        """Drop cached rows more than ``margin`` rows away from the view"""
+        keep_from = max(0, self.offset - self.margin - self.window_start)
+        if keep_from:
+            del self.rows[:keep_from]
+            self.window_start += keep_from
+        keep_to = self.offset + self.visible + self.margin - self.window_start
+        del self.rows[max(0, keep_to):]
+
+    def render(self):
+        selected = set(self.tree.selection())
+        self.tree.delete(*self.tree.get_children())
+        first = self.offset - self.window_start
+        for key, iid, values in self.rows[first:first + self.visible]:
+            self.tree.insert("", "end", iid=iid, values=values)
+            if iid in selected:
+                self.tree.selection_add(iid)
+        if self.total:
+            self.scrollbar.set(self.offset / self.total,
+                               min(1.0, (self.offset + self.visible) / self.total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def update_row(self, iid, values):
+        """Change the values of a row in place if it is cached or visible"""
+        for idx, (key, row_iid, _) in enumerate(self.rows):
+            if row_iid == iid:
+                self.rows[idx] = (key, iid, values)
+                break
+        if self.tree.exists(iid):
+            self.tree.item(iid, values=values)
+
+    def row_added_at_top(self):
+        """A row was added that sorts before every other row"""
+        self.total += 1
+        if self.offset == 0:
+            self.rows = []
+            self.scroll_to(0)
+        else:
+            # Keep the same rows in view; they have moved down by one
+            self.offset += 1
+            self.window_start += 1
+            self.render()
+
+    def contains(self, iid):
+        return any(row_iid == iid for _, row_iid, _ in self.rows)
+
+    def on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self.scroll_to(int(float(args[0]) * self.total))
+        elif action == "scroll":
+            step = self.visible if args[1] == "pages" else 1
+            self.scroll_to(self.offset + int(args[0]) * step)
+
+    def on_mousewheel(self, event):
+        self.scroll_to(self.offset - 3 * (1 if event.delta > 0 else -1))
+        return "break"
+
+    def on_resize(self, event):
+        # One row's worth of height goes to the headings
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        visible = max(1, (event.height - row_height) // row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.margin = max(self.margin, 2 * visible)
+            self.scroll_to(self.offset)